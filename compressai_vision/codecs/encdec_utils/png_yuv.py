@@ -27,17 +27,87 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import concurrent.futures as cf
+import ctypes
+import ctypes.util
 import logging
 import math
+import os
 import shutil
+import subprocess
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from PIL import Image
+from torchvision.io import ImageReadMode, read_image
 
 from compressai_vision.utils.external_exec import run_cmdline
 
 from .rawvideo import get_raw_video_file_info
 
+# full range BT.601 coefficients, as used by ffmpeg for untagged rgb inputs
+RGB_TO_YCBCR_BT601 = (
+    (0.299, 0.587, 0.114),
+    (-0.168736, -0.331264, 0.5),
+    (0.5, -0.418688, -0.081312),
+)
+
+# libyuv naming: RAW is packed R,G,B bytes, J420 is full range BT.601 4:2:0
+LIBYUV_FUNCTIONS = ("RAWToJ420", "J420ToRAW", "I420ToRAW")
+
+# chroma formats written by the torch conversion backend
+TORCH_CHROMA_FORMATS = ["400", "420", "444"]
+
+
+@lru_cache(maxsize=None)
+def load_libyuv():
+    """Returns the libyuv shared library if installed on the system, None otherwise"""
+    name = ctypes.util.find_library("yuv")
+    if name is None:
+        return None
+
+    try:
+        lib = ctypes.CDLL(name)
+    except OSError:
+        return None
+
+    if not all(hasattr(lib, fn) for fn in LIBYUV_FUNCTIONS):
+        return None
+
+    # all used functions take 4 (plane pointer, stride) pairs followed by width, height
+    for fn in LIBYUV_FUNCTIONS:
+        getattr(lib, fn).argtypes = [ctypes.c_void_p, ctypes.c_int] * 4 + [
+            ctypes.c_int,
+            ctypes.c_int,
+        ]
+        getattr(lib, fn).restype = ctypes.c_int
+    return lib
+
+
+def _rescale_8bit_samples(plane: np.ndarray, max_value: int):
+    """rescales full range 8-bit samples to [0, max_value] with rounding"""
+    plane = (plane.astype(np.uint32) * max_value + 127) // 255
+    return plane.astype("<u2")
+
+
+def _image_mode(image_file) -> str:
+    """reads the mode of an image from its header, without decoding it"""
+    with Image.open(image_file) as im:
+        return im.mode
+
+
+def _check_libyuv_backend(backend: str, logger: logging.Logger):
+    if backend == "libyuv" and load_libyuv() is None:
+        logger.warning("libyuv is not available, ffmpeg is used for the conversion")
+        return "ffmpeg"
+    return backend
+
 
 class PngFilesToYuvFileConverter:
     def __init__(
@@ -48,6 +118,9 @@ class PngFilesToYuvFileConverter:
         frame_rate,
         ffmpeg_loglevel: str,
         logger: logging.Logger,
+        num_workers: int = 1,
+        backend: str = "ffmpeg",
+        device: str = "cpu",
     ):
         self.chroma_format = chroma_format
         self.input_bitdepth = input_bitdepth
@@ -55,6 +128,31 @@ class PngFilesToYuvFileConverter:
         self.frame_rate = frame_rate
         self.ffmpeg_loglevel = ffmpeg_loglevel
         self.logger = logger
+        self.num_workers = num_workers
+
+        assert backend in [
+            "ffmpeg",
+            "torch",
+            "libyuv",
+        ], f"Unknown conversion backend: {backend}"
+        if backend == "torch" and device.startswith("cuda"):
+            if not torch.cuda.is_available():
+                self.logger.warning(
+                    "CUDA is not available, ffmpeg is used for the yuv conversion"
+                )
+                backend = "ffmpeg"
+        if backend == "torch" and chroma_format not in TORCH_CHROMA_FORMATS:
+            self.logger.warning(
+                f"torch backend does not support {chroma_format}, ffmpeg is used instead"
+            )
+            backend = "ffmpeg"
+        if backend == "libyuv" and chroma_format not in ["400", "420"]:
+            self.logger.warning(
+                f"libyuv backend does not support {chroma_format}, ffmpeg is used instead"
+            )
+            backend = "ffmpeg"
+        self.backend = _check_libyuv_backend(backend, logger)
+        self.device = device
 
     def __call__(self, input: Dict, file_prefix: str):
         """Converts the input image or video to YUV format using ffmpeg.
@@ -78,6 +176,117 @@ class PngFilesToYuvFileConverter:
         Raises:
             AssertionError: If the number of images in the input folder does not match the expected number of frames.
         """
+        (
+            input_info,
+            image_files,
+            yuv_file,
+            nb_frames,
+            frame_width,
+            frame_height,
+            file_prefix,
+        ) = self._get_input_info(input, file_prefix)
+        yuv_in_path = f"{file_prefix}_input.yuv"
+
+        chroma_format = self.chroma_format
+        input_bitdepth = self.input_bitdepth
+        chroma_format = "gray" if chroma_format == "400" else f"yuv{chroma_format}p"
+
+        # Use existing YUV (if found and indicated for use):
+        if self.use_yuv:
+            assert (
+                yuv_file is not None
+            ), "Parameter 'use_yuv' set True but YUV file not found."
+            size = yuv_file.stat().st_size
+            bytes_per_luma_sample = {"yuv420p": 1.5}[chroma_format]
+            bytes_per_sample = (input_bitdepth + 7) >> 3
+            expected_size = int(
+                frame_width
+                * frame_height
+                * bytes_per_luma_sample
+                * bytes_per_sample
+                * nb_frames
+            )
+            assert (
+                size == expected_size
+            ), f"YUV found for input but expected size of {expected_size} bytes differs from actual size of {size} bytes"
+            # a hard link shares the source yuv data, nothing is converted nor copied
+            Path(yuv_in_path).unlink(missing_ok=True)  # e.g., a previous link
+            try:
+                os.link(yuv_file, yuv_in_path)
+            except OSError:  # e.g., different file systems
+                shutil.copy(yuv_file, yuv_in_path)
+            print(f"Using pre-existing YUV file: {yuv_file}")
+            return (yuv_in_path, nb_frames, frame_width, frame_height, file_prefix)
+
+        convert_cmd, output_info = self._get_ffmpeg_cmd()
+
+        if self.backend != "ffmpeg" and all(_image_mode(f) == "L" for f in image_files):
+            # NOTE: the default ffmpeg backend (also used to stream the conversion)
+            # keeps converting gray inputs itself, so that its output is unchanged
+            self._convert_gray_frames(
+                image_files, yuv_in_path, frame_width, frame_height
+            )
+            return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+
+        if self.backend == "torch":
+            self._convert_frames_torch(
+                image_files, yuv_in_path, frame_width, frame_height
+            )
+            return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+
+        if self.backend == "libyuv":
+            self._convert_frames_libyuv(
+                image_files, yuv_in_path, frame_width, frame_height
+            )
+            return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+
+        if self.num_workers > 1 and nb_frames > 1:
+            self._convert_frames_parallel(
+                convert_cmd, output_info, image_files, yuv_in_path
+            )
+            return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+
+        convert_cmd += input_info
+        convert_cmd += output_info
+
+        convert_cmd.append(yuv_in_path)
+        self.logger.debug(convert_cmd)
+
+        run_cmdline(convert_cmd)
+
+        return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+
+    @property
+    def can_stream(self) -> bool:
+        """whether the conversion can be streamed with get_stream_cmd"""
+        return self.backend == "ffmpeg" and not self.use_yuv
+
+    def get_stream_cmd(self, input: Dict, file_prefix: str):
+        """Returns the ffmpeg command converting the input image or video to raw YUV
+        frames written to its standard output, e.g., to be piped to an encoder,
+        instead of converting to a YUV file.
+
+        Args:
+            input (Dict): same as for __call__.
+            file_prefix (str): The prefix for the output file name.
+
+        Returns:
+            Tuple[List[str], int, int, int, str]: the ffmpeg command line, the number
+            of frames, the frame width and height, and the updated file prefix.
+        """
+        assert self.can_stream, "only the plain ffmpeg conversion can be streamed"
+
+        input_info, _, _, nb_frames, frame_width, frame_height, file_prefix = (
+            self._get_input_info(input, file_prefix)
+        )
+        convert_cmd, output_info = self._get_ffmpeg_cmd()
+        convert_cmd = [*convert_cmd, *input_info, *output_info, "pipe:1"]
+        self.logger.debug(convert_cmd)
+
+        return convert_cmd, nb_frames, frame_width, frame_height, file_prefix
+
+    def _get_input_info(self, input: Dict, file_prefix: str):
+        """ffmpeg input arguments, input files and frame size of the input"""
         file_names = input["file_names"]
         if len(file_names) > 1:  # video
             # NOTE: using glob for now, should be more robust and look at skipped
@@ -99,6 +308,8 @@ class PngFilesToYuvFileConverter:
                 "-i",
                 filename_pattern,
             ]
+            # same (alphabetical) order as the ffmpeg glob pattern
+            image_files = sorted(parent.glob(ext))
 
             yuv_file = Path(f"{Path(file_names[0]).parent.parent}.yuv")
             print(f"Checking if YUV is available: {yuv_file}")
@@ -108,43 +319,33 @@ class PngFilesToYuvFileConverter:
         else:
             nb_frames = 1
             input_info = ["-i", file_names[0]]
+            image_files = [file_names[0]]
             yuv_file = None
 
-        chroma_format = self.chroma_format
         input_bitdepth = self.input_bitdepth
 
         frame_width = math.ceil(input["org_input_size"]["width"] / 2) * 2
         frame_height = math.ceil(input["org_input_size"]["height"] / 2) * 2
-        file_prefix = f"{file_prefix}_{frame_width}x{frame_height}_{self.frame_rate}fps_{input_bitdepth}bit_p{chroma_format}"
-        yuv_in_path = f"{file_prefix}_input.yuv"
+        file_prefix = f"{file_prefix}_{frame_width}x{frame_height}_{self.frame_rate}fps_{input_bitdepth}bit_p{self.chroma_format}"
+
+        return (
+            input_info,
+            image_files,
+            yuv_file,
+            nb_frames,
+            frame_width,
+            frame_height,
+            file_prefix,
+        )
 
+    def _get_ffmpeg_cmd(self):
+        """ffmpeg command prefix and raw yuv output arguments"""
+        chroma_format = self.chroma_format
         chroma_format = "gray" if chroma_format == "400" else f"yuv{chroma_format}p"
 
-        # Use existing YUV (if found and indicated for use):
-        if self.use_yuv:
-            assert (
-                yuv_file is not None
-            ), "Parameter 'use_yuv' set True but YUV file not found."
-            size = yuv_file.stat().st_size
-            bytes_per_luma_sample = {"yuv420p": 1.5}[chroma_format]
-            bytes_per_sample = (input_bitdepth + 7) >> 3
-            expected_size = int(
-                frame_width
-                * frame_height
-                * bytes_per_luma_sample
-                * bytes_per_sample
-                * nb_frames
-            )
-            assert (
-                size == expected_size
-            ), f"YUV found for input but expected size of {expected_size} bytes differs from actual size of {size} bytes"
-            shutil.copy(yuv_file, yuv_in_path)
-            print(f"Using pre-existing YUV file: {yuv_file}")
-            return (yuv_in_path, nb_frames, frame_width, frame_height, file_prefix)
-
         # TODO (fracape)
         # we don't enable skipping frames (codec.skip_n_frames) nor use n_frames_to_be_encoded in video mode
-        pix_fmt_suffix = "10le" if input_bitdepth == 10 else ""
+        pix_fmt_suffix = "10le" if self.input_bitdepth == 10 else ""
 
         convert_cmd = [
             "ffmpeg",
@@ -153,8 +354,7 @@ class PngFilesToYuvFileConverter:
             "-loglevel",
             f"{self.ffmpeg_loglevel}",
         ]
-        convert_cmd += input_info
-        convert_cmd += [
+        output_info = [
             "-vf",
             "pad=ceil(iw/2)*2:ceil(ih/2)*2",
             "-f",
@@ -164,20 +364,156 @@ class PngFilesToYuvFileConverter:
             "-dst_range",
             "1",  #  (fracape) convert to full range for now
         ]
+        return convert_cmd, output_info
 
-        convert_cmd.append(yuv_in_path)
-        self.logger.debug(convert_cmd)
+    def _convert_frames_parallel(
+        self,
+        base_cmd: List[str],
+        output_info: List[str],
+        image_files: List[Path],
+        yuv_in_path: str,
+    ):
+        """Converts each image with its own ffmpeg process, using a pool of workers,
+        and appends the raw frames to the YUV file in display order."""
 
-        run_cmdline(convert_cmd)
+        def convert_one_frame(image_file):
+            cmd = [*base_cmd, "-i", f"{image_file}", *output_info, "pipe:1"]
+            return subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
 
-        return yuv_in_path, nb_frames, frame_width, frame_height, file_prefix
+        self.logger.debug(
+            f"converting {len(image_files)} images with {self.num_workers} workers"
+        )
+        with cf.ThreadPoolExecutor(self.num_workers) as executor:
+            with open(yuv_in_path, "wb") as fw:
+                # map yields the results in submission order
+                for raw_frame in executor.map(convert_one_frame, image_files):
+                    fw.write(raw_frame)
+
+    @torch.no_grad()
+    def _convert_frames_torch(
+        self,
+        image_files: List[Path],
+        yuv_in_path: str,
+        frame_width: int,
+        frame_height: int,
+    ):
+        """Converts the images to full range YUV with torch on the configured device,
+        padded to even sizes like the ffmpeg pad filter."""
+
+        assert (
+            self.chroma_format in TORCH_CHROMA_FORMATS
+        ), f"torch backend does not support {self.chroma_format}"
+
+        max_value = (2**self.input_bitdepth) - 1
+        dtype = "<u2" if self.input_bitdepth > 8 else "u1"
+        matrix = torch.tensor(RGB_TO_YCBCR_BT601, device=self.device)
+        offset = torch.tensor([0.0, 0.5, 0.5], device=self.device).view(3, 1, 1)
+
+        with open(yuv_in_path, "wb") as fw:
+            for image_file in image_files:
+                rgb = read_image(f"{image_file}", ImageReadMode.RGB)
+                rgb = rgb.to(self.device, non_blocking=True).float() / 255
+                _, h, w = rgb.shape
+                rgb = F.pad(rgb, (0, frame_width - w, 0, frame_height - h))
+
+                yuv = torch.einsum("chw,kc->khw", rgb, matrix) + offset
+
+                planes = [yuv[0]]
+                if self.chroma_format == "420":
+                    planes += list(F.avg_pool2d(yuv[1:].unsqueeze(0), 2)[0])
+                elif self.chroma_format == "444":
+                    planes += list(yuv[1:])
+
+                for plane in planes:
+                    plane = (plane * max_value).round_().clamp_(0, max_value)
+                    np.asarray(plane.cpu().numpy(), dtype=dtype).tofile(fw)
+
+    def _convert_frames_libyuv(
+        self,
+        image_files: List[Path],
+        yuv_in_path: str,
+        frame_width: int,
+        frame_height: int,
+    ):
+        """Converts the images to full range YUV 4:2:0 (or its luma only) with libyuv,
+        padded to even sizes like the ffmpeg pad filter."""
+
+        lib = load_libyuv()
+        max_value = (2**self.input_bitdepth) - 1
+
+        rgb = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
+        y = np.empty((frame_height, frame_width), dtype=np.uint8)
+        u = np.empty((frame_height // 2, frame_width // 2), dtype=np.uint8)
+        v = np.empty_like(u)
+        planes = [y] if self.chroma_format == "400" else [y, u, v]
+
+        with open(yuv_in_path, "wb") as fw:
+            for image_file in image_files:
+                with Image.open(image_file) as im:
+                    img = np.asarray(im.convert("RGB"))
+                h, w, _ = img.shape
+                rgb[:h, :w] = img
+
+                ret = lib.RAWToJ420(
+                    rgb.ctypes.data,
+                    rgb.strides[0],
+                    y.ctypes.data,
+                    y.strides[0],
+                    u.ctypes.data,
+                    u.strides[0],
+                    v.ctypes.data,
+                    v.strides[0],
+                    frame_width,
+                    frame_height,
+                )
+                assert ret == 0, f"libyuv failed to convert {image_file}"
+
+                for plane in planes:
+                    if max_value > 255:
+                        plane = _rescale_8bit_samples(plane, max_value)
+                    plane.tofile(fw)
+
+    def _convert_gray_frames(
+        self,
+        image_files: List[Path],
+        yuv_in_path: str,
+        frame_width: int,
+        frame_height: int,
+    ):
+        """Writes single channel images directly as the luma plane, with flat chroma
+        planes when needed, since no color conversion is involved."""
+
+        max_value = (2**self.input_bitdepth) - 1
+        dtype = "<u2" if max_value > 255 else np.uint8
+
+        y = np.zeros((frame_height, frame_width), dtype=np.uint8)
+        chroma_size = {"400": 0, "420": y.size // 2, "422": y.size, "444": y.size * 2}
+        flat_chroma = np.full(
+            chroma_size[self.chroma_format], (max_value + 1) // 2, dtype=dtype
+        )
+
+        with open(yuv_in_path, "wb") as fw:
+            for image_file in image_files:
+                with Image.open(image_file) as im:
+                    img = np.asarray(im)
+                h, w = img.shape
+                y[:h, :w] = img
+
+                plane = _rescale_8bit_samples(y, max_value) if max_value > 255 else y
+                plane.tofile(fw)
+                flat_chroma.tofile(fw)
 
 
 class YuvFileToPngFilesConverter:
-    def __init__(self, datacatalog: str, logger: logging.Logger):
+    def __init__(
+        self, datacatalog: str, logger: logging.Logger, backend: str = "ffmpeg"
+    ):
         self.datacatalog = datacatalog
         self.logger = logger
 
+        assert backend in ["ffmpeg", "libyuv"], f"Unknown conversion backend: {backend}"
+        self.backend = _check_libyuv_backend(backend, logger)
+
     def __call__(
         self,
         output_file_prefix: str,
@@ -216,52 +552,68 @@ class YuvFileToPngFilesConverter:
 
         output_png = f"{dec_path}/{output_png_filename}"
 
-        convert_cmd = [
-            "ffmpeg",
-            "-y",
-            "-hide_banner",
-            "-loglevel",
-            "error",
-            "-f",
-            "rawvideo",
-            "-pix_fmt",
-            f"{chroma_format}{pix_fmt_suffix}",
-            "-s",
-            f"{frame_width}x{frame_height}",
-        ]
+        if self.backend == "libyuv":
+            start_number = (
+                int(cmd_suffix[cmd_suffix.index("-start_number") + 1])
+                if "-start_number" in cmd_suffix
+                else 1  # same default as ffmpeg
+            )
+            self._convert_frames_libyuv(
+                yuv_dec_path,
+                output_png,
+                start_number,
+                frame_width,
+                frame_height,
+                video_info["bitdepth"],
+                full_range=not vcm_mode,
+            )
+        else:
+            convert_cmd = [
+                "ffmpeg",
+                "-y",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                f"{chroma_format}{pix_fmt_suffix}",
+                "-s",
+                f"{frame_width}x{frame_height}",
+            ]
+
+            if not vcm_mode:
+                convert_cmd.extend(
+                    [
+                        "-src_range",
+                        "1",  # (fracape) assume dec yuv is full range for now
+                    ]
+                )
 
-        if not vcm_mode:
             convert_cmd.extend(
                 [
-                    "-src_range",
-                    "1",  # (fracape) assume dec yuv is full range for now
+                    "-i",
+                    f"{yuv_dec_path}",
+                    "-pix_fmt",
+                    "rgb24",
                 ]
             )
 
-        convert_cmd.extend(
-            [
-                "-i",
-                f"{yuv_dec_path}",
-                "-pix_fmt",
-                "rgb24",
-            ]
-        )
-
-        if vcm_mode:
+            if vcm_mode:
+                convert_cmd.extend(
+                    [
+                        "-vsync",
+                        "1",
+                    ]
+                )
             convert_cmd.extend(
                 [
-                    "-vsync",
-                    "1",
+                    *cmd_suffix,
+                    output_png,
                 ]
             )
-        convert_cmd.extend(
-            [
-                *cmd_suffix,
-                output_png,
-            ]
-        )
 
-        run_cmdline(convert_cmd)
+            run_cmdline(convert_cmd)
 
         if org_img_size is not None and (
             frame_height != org_img_size["height"]
@@ -280,6 +632,55 @@ class YuvFileToPngFilesConverter:
 
             self._crop_decoded_png(output_png, dec_path, org_img_size)
 
+    def _convert_frames_libyuv(
+        self,
+        yuv_dec_path: Path,
+        output_png: str,
+        start_number: int,
+        frame_width: int,
+        frame_height: int,
+        bitdepth: int,
+        full_range: bool,
+    ):
+        """Converts the frames of a YUV 4:2:0 file to RGB PNG images with libyuv."""
+
+        lib = load_libyuv()
+        convert = lib.J420ToRAW if full_range else lib.I420ToRAW
+        max_value = (2**bitdepth) - 1
+
+        luma_size = frame_width * frame_height
+        chroma_size = luma_size // 4
+        frames = np.fromfile(yuv_dec_path, dtype="<u2" if bitdepth > 8 else np.uint8)
+        frames = frames.reshape(-1, luma_size + 2 * chroma_size)
+
+        rgb = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+        for idx, frame in enumerate(frames):
+            if max_value > 255:
+                frame = (frame.astype(np.uint32) * 255 + max_value // 2) // max_value
+                frame = frame.astype(np.uint8)
+
+            y = frame[:luma_size]
+            u = frame[luma_size : luma_size + chroma_size]
+            v = frame[luma_size + chroma_size :]
+            ret = convert(
+                y.ctypes.data,
+                frame_width,
+                u.ctypes.data,
+                frame_width // 2,
+                v.ctypes.data,
+                frame_width // 2,
+                rgb.ctypes.data,
+                rgb.strides[0],
+                frame_width,
+                frame_height,
+            )
+            assert ret == 0, f"libyuv failed to convert frame {idx} of {yuv_dec_path}"
+
+            filename = (
+                output_png % (start_number + idx) if "%" in output_png else output_png
+            )
+            Image.fromarray(rgb).save(filename)
+
     def _crop_decoded_png(self, output_png: str, dec_path: str, org_img_size: Dict):
         tmp_output_png = f"{dec_path}/{Path(output_png).stem}_tmp.png"
 
@@ -27,7 +27,6 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import configparser
 import json
 import logging
 import time
@@ -46,7 +45,13 @@ from compressai_vision.utils.dataio import PixelFormat, readwriteYUV
 from compressai_vision.utils.external_exec import run_cmdline
 
 from .encdec_utils import get_raw_video_file_info
-from .utils import MIN_MAX_DATASET, min_max_inv_normalization, min_max_normalization
+from .utils import (
+    MIN_MAX_DATASET,
+    load_fpn_sizes,
+    min_max_inv_normalization,
+    min_max_normalization,
+    read_frame_rate_from_seqinfo,
+)
 
 
 def get_filesize(filepath: Union[Path, str]) -> int:
@@ -76,9 +81,9 @@ class x264(nn.Module):
 
         self.frame_rate = 1
         if not self.datacatalog == "MPEGOIV6":
-            config = configparser.ConfigParser()
-            config.read(f"{dataset['config']['root']}/{dataset['config']['seqinfo']}")
-            self.frame_rate = config["Sequence"]["frameRate"]
+            self.frame_rate = read_frame_rate_from_seqinfo(
+                f"{dataset['config']['root']}/{dataset['config']['seqinfo']}"
+            )
 
         if self.datacatalog in MIN_MAX_DATASET:
             self.min_max_dataset = MIN_MAX_DATASET[self.datacatalog]
@@ -238,8 +243,8 @@ class x264(nn.Module):
             frmWidth=frame_width,
             frmHeight=frame_height,
         )
-        for i, frame in enumerate(frames):
-            self.yuvio.write_one_frame(frame, mid_level=mid_level, frame_idx=i)
+        self.yuvio.write_multiple_frames(frames, mid_level=mid_level)
+        self.yuvio.closeWriter()
 
         cmd = self.get_encode_cmd(
             yuv_in_path,
@@ -333,16 +338,13 @@ class x264(nn.Module):
             get_filesize(yuv_dec_path) // (frame_width * frame_height * 2 * 3)
         )
 
-        rec_frames = []
-        for i in range(nbframes):
-            rec_yuv = self.yuvio.read_one_frame(i)
-            rec_frames.append(rec_yuv)
-
-        rec_frames = torch.stack(rec_frames)
+        rec_frames = self.yuvio.read_multiple_frames(nbframes)
 
         start = time_measure()
         minv, maxv = self.min_max_dataset
-        rec_frames = min_max_inv_normalization(rec_frames, minv, maxv, bitdepth=10)
+        rec_frames = min_max_inv_normalization(
+            rec_frames, minv, maxv, bitdepth=10, inplace=True
+        )
 
         # TODO (fracape) should feature sizes be part of bitstream even for anchors
         thisdir = Path(__file__).parent
@@ -354,12 +356,7 @@ class x264(nn.Module):
             fpn_sizes = thisdir.joinpath(
                 f"../../data/mpeg-fcm/{self.datacatalog}/fpn-sizes/{self.dataset_name}.json"
             )
-        with fpn_sizes.open("r") as f:
-            try:
-                json_dict = json.load(f)
-            except json.decoder.JSONDecodeError as err:
-                print(f'Error reading file "{fpn_sizes}"')
-                raise err
+        json_dict = load_fpn_sizes(str(fpn_sizes))
 
         features = self.fpn_utils.reshape_frame_to_feature_pyramid(
             rec_frames,
@@ -27,18 +27,23 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import configparser
+import hashlib
 import json
 import logging
 import math
+import mmap
 import os
+import shutil
+import stat
 import sys
 import time
 
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -46,12 +51,28 @@ from compressai_vision.codecs.utils import FpnUtils
 from compressai_vision.model_wrappers import BaseWrapper
 from compressai_vision.registry import register_codec
 from compressai_vision.utils import time_measure
-from compressai_vision.utils.dataio import PixelFormat, readwriteYUV
-from compressai_vision.utils.external_exec import run_cmdline, run_cmdlines_parallel
+from compressai_vision.utils.dataio import (
+    PixelFormat,
+    advise_file_access,
+    readwriteYUV,
+)
+from compressai_vision.utils.external_exec import (
+    run_cmdline,
+    run_cmdline_to_output,
+    run_cmdline_with_input,
+    run_cmdline_with_output,
+    run_cmdlines_parallel,
+)
 
 from .encdec_utils import *
 from .encdec_utils.png_yuv import PngFilesToYuvFileConverter, YuvFileToPngFilesConverter
-from .utils import MIN_MAX_DATASET, min_max_inv_normalization, min_max_normalization
+from .utils import (
+    MIN_MAX_DATASET,
+    load_fpn_sizes,
+    min_max_inv_normalization,
+    min_max_normalization,
+    read_frame_rate_from_seqinfo,
+)
 from .vcmrs_descriptors import get_descriptor_files
 
 
@@ -81,6 +102,34 @@ def load_bitstream(path):
     return buf.getvalue()
 
 
+def copy_file_tail(src_fd, dst_fd, offset: int):
+    """
+    Append the contents of an opened file, from offset to its end, to another opened file.
+    The copy happens in kernel space with sendfile when available.
+    Args:
+        src_fd: the source file object, opened in binary mode.
+        dst_fd: the destination file object, opened in binary write mode.
+        offset (int): position in the source file where the copy starts.
+    """
+    dst_fd.flush()  # data already written to dst_fd must come first
+
+    num_remaining = os.fstat(src_fd.fileno()).st_size - offset
+    try:
+        while num_remaining > 0:
+            sent = os.sendfile(dst_fd.fileno(), src_fd.fileno(), offset, num_remaining)
+            if sent == 0:
+                break
+            offset += sent
+            num_remaining -= sent
+    except (AttributeError, OSError):
+        # sendfile is not available for these files, copy the rest in user space
+        pass
+
+    if num_remaining > 0:
+        src_fd.seek(offset)
+        shutil.copyfileobj(src_fd, dst_fd)
+
+
 @register_codec("vtm")
 class VTM(nn.Module):
     """Encoder/Decoder class for VVC - VTM reference software"""
@@ -97,8 +146,20 @@ class VTM(nn.Module):
         self.codec_paths = kwargs["codec_paths"]
 
         self.parallel_encoding = self.enc_cfgs["parallel_encoding"]  # parallel option
+        # max. number of encoding jobs running at once, each encoding an intra period
+        self.parallel_workers = self.enc_cfgs.get("parallel_workers", None)
+        # optional number of cpus each parallel encoder is pinned to
+        self.cores_per_worker = self.enc_cfgs.get("cores_per_worker", None)
         self.hash_check = self.enc_cfgs["hash_check"]  # md5 hash check
         self.stash_outputs = self.enc_cfgs["stash_outputs"]
+        # pipe the packed features to the encoder instead of writing a yuv file
+        self.stream_yuv_input = self.enc_cfgs.get("stream_yuv_input", False)
+        # read the decoded frames from a pipe while the decoder writes them
+        self.stream_yuv_output = self.enc_cfgs.get("stream_yuv_output", False)
+        # optional directory, e.g., a tmpfs like /dev/shm, for yuv files not dumped
+        self.tmp_yuv_dir = self.enc_cfgs.get("tmp_yuv_dir", None)
+        # optional directory keeping the packed feature yuv files across qps
+        self.yuv_cache_dir = self.enc_cfgs.get("yuv_cache_dir", None)
 
         check_list_of_paths = self.get_check_list_of_paths()
         if self.parallel_encoding:  # miminum
@@ -131,11 +192,15 @@ class VTM(nn.Module):
         self.yuvio = readwriteYUV(device="cpu", format=PixelFormat.YUV400_10le)
 
         self.intra_period = self.enc_cfgs["intra_period"]
+        decodingRefreshType = 1 if self.intra_period >= 1 else 0
+        self._decoding_refresh_type_arg = f"--DecodingRefreshType={decodingRefreshType}"
+        # memoized encoder arguments, see _get_static_cmd_args
+        self._static_cmd_args = {}
         self.frame_rate = 1
         if not (self.datacatalog == "MPEGOIV6" or self.datacatalog == "MPEGSAM"):
-            config = configparser.ConfigParser()
-            config.read(f"{dataset['config']['root']}/{dataset['config']['seqinfo']}")
-            self.frame_rate = config["Sequence"]["frameRate"]
+            self.frame_rate = read_frame_rate_from_seqinfo(
+                f"{dataset['config']['root']}/{dataset['config']['seqinfo']}"
+            )
 
         self.logger = logging.getLogger(self.__class__.__name__)
         self.verbosity = kwargs["verbosity"]
@@ -156,11 +221,19 @@ class VTM(nn.Module):
             frame_rate=self.frame_rate,
             ffmpeg_loglevel=self.ffmpeg_loglevel,
             logger=self.logger,
+            num_workers=self.enc_cfgs.get("conversion_workers", 1),
+            backend=self.enc_cfgs.get("conversion_backend", "ffmpeg"),
+            device=self.enc_cfgs.get("conversion_device", "cpu"),
         )
 
         self.convert_yuv_to_pngs = YuvFileToPngFilesConverter(
             datacatalog=self.datacatalog,
             logger=self.logger,
+            backend=(
+                "libyuv"
+                if self.enc_cfgs.get("conversion_backend") == "libyuv"
+                else "ffmpeg"
+            ),
         )
 
         self.fpn_utils = FpnUtils()
@@ -190,8 +263,8 @@ class VTM(nn.Module):
     def reset(self):
         self._header_writer = HeaderWriter()
         self._header_reader = HeaderReader()
-        self._frame_info_buffer = []
-        self._temp_io_buffer = BytesIO()
+        self._frame_info = None
+        self._num_frame_infos = 0
         self._bitstream_fd = None
 
     def open_bitstream_file(self, path, mode="rb"):
@@ -204,6 +277,42 @@ class VTM(nn.Module):
             self._bitstream_fd.close()
             self._bitstream_fd = None
 
+    def _get_tmp_yuv_path(self, yuv_path, num_bytes: int) -> Path:
+        """
+        Returns the path of a temporary yuv file in tmp_yuv_dir if set and with
+        enough free space for num_bytes, or yuv_path otherwise.
+        """
+        if self.tmp_yuv_dir is None:
+            return Path(yuv_path)
+
+        stats = os.statvfs(self.tmp_yuv_dir)
+        if stats.f_bavail * stats.f_frsize < num_bytes:
+            self.logger.warning(
+                f"Not enough space in {self.tmp_yuv_dir}, writing {yuv_path} instead"
+            )
+            return Path(yuv_path)
+
+        return Path(self.tmp_yuv_dir) / Path(yuv_path).name
+
+    def _get_yuv_cache_path(
+        self, yuv_path, bitstream_name: str, frames: torch.Tensor
+    ) -> str:
+        """
+        Returns the path in yuv_cache_dir of the yuv file yuv_path of the packed
+        features frames, named without the qp so that it is shared by all the qps,
+        and with a digest of the features and their normalization range so that
+        the yuv of other features (e.g., from another model or split) is not reused.
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(np.asarray(self.min_max_dataset, dtype=np.float64).tobytes())
+        digest.update(frames.detach().cpu().contiguous().numpy().tobytes())
+
+        path = Path(yuv_path)
+        name = path.name.replace(bitstream_name, bitstream_name.split("_qp")[0], 1)
+        name = f"{Path(name).stem}_{digest.hexdigest()}{path.suffix}"
+        Path(self.yuv_cache_dir).mkdir(parents=True, exist_ok=True)
+        return str(Path(self.yuv_cache_dir) / name)
+
     def get_encode_cmd(
         self,
         inp_yuv_path: Path,
@@ -239,36 +348,32 @@ class VTM(nn.Module):
         if output_bitdepth == 0:
             output_bitdepth = input_bitdepth
 
-        decodingRefreshType = 1 if self.intra_period >= 1 else 0
         base_cmd = [
-            self.encoder_path,
+            f"{self.encoder_path}",
             "-i",
-            inp_yuv_path,
+            f"{inp_yuv_path}",
             "-c",
-            self.cfg_file,
+            f"{self.cfg_file}",
             "-q",
-            qp,
+            f"{qp}",
             "-o",
             "/dev/null",
             "-wdt",
-            width,
+            f"{width}",
             "-hgt",
-            height,
+            f"{height}",
             "-fr",
-            self.frame_rate,
+            f"{self.frame_rate}",
             "-ts",  # temporal subsampling to prevent default period of 8 in all intra
             "1",
             "-v",
             "6",
-            f"--Level={level}",
-            f"--IntraPeriod={self.intra_period}",
-            f"--InputChromaFormat={chroma_format}",
-            f"--InputBitDepth={input_bitdepth}",
-            f"--InternalBitDepth={output_bitdepth}",
-            "--ConformanceWindowMode=1",  # needed?
+            *self._get_static_cmd_args(
+                level, chroma_format, input_bitdepth, output_bitdepth
+            ),
             "-dph",  # md5 has,
-            hash_check,
-            f"--DecodingRefreshType={decodingRefreshType}",
+            f"{hash_check}",
+            self._decoding_refresh_type_arg,
         ]
 
         if parallel_encoding is False or nb_frames <= self.intra_period + 1:
@@ -278,7 +383,6 @@ class VTM(nn.Module):
                 f"--BitstreamFile={bitstream_path}",
                 f"--FramesToBeEncoded={nb_frames}",
             ]
-            cmd = [str(x) for x in cmd]
             self.logger.debug(cmd)
             cmds = [cmd]
         else:
@@ -286,20 +390,37 @@ class VTM(nn.Module):
 
         return cmds
 
+    def _get_static_cmd_args(
+        self, level, chroma_format, input_bitdepth, output_bitdepth
+    ) -> List[str]:
+        """
+        Returns the encoder arguments shared by all encodings with the same settings,
+        built once per combination of settings.
+        """
+        key = (level, chroma_format, input_bitdepth, output_bitdepth)
+        if key not in self._static_cmd_args:
+            self._static_cmd_args[key] = [
+                f"--Level={level}",
+                f"--IntraPeriod={self.intra_period}",
+                f"--InputChromaFormat={chroma_format}",
+                f"--InputBitDepth={input_bitdepth}",
+                f"--InternalBitDepth={output_bitdepth}",
+                "--ConformanceWindowMode=1",  # needed?
+            ]
+        return self._static_cmd_args[key]
+
     def _parallel_encode_cmd(
         self, base_cmd: List, bitstream_path: Path, nb_frames: int
     ):
-        num_workers = round((nb_frames / self.intra_period) + 0.5)
-
         frame_offsets, frame_counts = _distribute_parallel_work(
-            nb_frames, num_workers, self.intra_period
+            nb_frames, self.intra_period
         )
 
         bitstream_path = Path(bitstream_path)
 
         cmds = []
 
-        assert num_workers < 10**3  # Due to the string formatting below.
+        assert len(frame_offsets) < 10**3  # Due to the string formatting below.
 
         for worker_idx, (frameSkip, framesToBeEncoded) in enumerate(
             zip(frame_offsets, frame_counts)
@@ -308,20 +429,28 @@ class VTM(nn.Module):
                 f"{bitstream_path.parent}/"
                 f"{bitstream_path.stem}-part-{worker_idx:03d}{bitstream_path.suffix}"
             )
-
-            cmd = [
-                *base_cmd,
-                f"--BitstreamFile={worker_bitstream_path}",
-                f"--FrameSkip={frameSkip}",
-                f"--FramesToBeEncoded={framesToBeEncoded}",
-            ]
-
-            cmd = [str(x) for x in cmd]
+            segment_args = self._segment_cmd_args(
+                worker_bitstream_path, frameSkip, framesToBeEncoded
+            )
+            cmd = [*base_cmd, *segment_args]
             self.logger.debug(cmd)
             cmds.append(cmd)
 
+        # kept in segment order, so that the job id in the name of each job's log
+        # is the index of its part; only the last intra period can be shorter, so
+        # the longest jobs are already started first and the short one fills the tail
         return cmds
 
+    def _segment_cmd_args(
+        self, bitstream_path, frame_skip: int, frames_to_be_encoded: int
+    ) -> List[str]:
+        """encoder arguments selecting the frames and the output of one parallel job"""
+        return [
+            f"--BitstreamFile={bitstream_path}",
+            f"--FrameSkip={frame_skip}",
+            f"--FramesToBeEncoded={frames_to_be_encoded}",
+        ]
+
     def get_parcat_cmd(
         self,
         bitstream_path: Path,
@@ -335,8 +464,11 @@ class VTM(nn.Module):
         """
         bp = Path(bitstream_path)
         bitstream_lists = sorted(bp.parent.glob(f"{bp.stem}-part-*{bp.suffix}"))
-        cmd = [self.parcat_path, *bitstream_lists, bitstream_path]
-        cmd = [str(x) for x in cmd]
+        cmd = [
+            f"{self.parcat_path}",
+            *[f"{partial}" for partial in bitstream_lists],
+            f"{bitstream_path}",
+        ]
         self.logger.debug(cmd)
         return cmd, bitstream_lists
 
@@ -395,8 +527,30 @@ class VTM(nn.Module):
 
         print(f"\n-- encoding {file_prefix}", file=sys.stdout)
 
-        # Conversion: reshape data to yuv domain (e.g. 420 or 400)
+        stream_input = (
+            self.stream_yuv_input
+            and not self.parallel_encoding
+            and not self.dump["dump_yuv_input"]
+        )
         if remote_inference:
+            # only the plain ffmpeg conversion writes its output to a pipe
+            stream_input = stream_input and self.convert_input_to_yuv.can_stream
+        else:
+            # a cached yuv is written to be read again
+            stream_input = stream_input and self.yuv_cache_dir is None
+
+        # Conversion: reshape data to yuv domain (e.g. 420 or 400)
+        if remote_inference and stream_input:
+            # ffmpeg output is piped to the encoder, conversion runs with encoding
+            start = time.time()
+            (convert_cmd, nb_frames, frame_width, frame_height, file_prefix) = (
+                self.convert_input_to_yuv.get_stream_cmd(
+                    input=x, file_prefix=file_prefix
+                )
+            )
+            yuv_in_path = "/dev/stdin"
+            conversion_time = time.time() - start
+        elif remote_inference:
             start = time.time()
             (yuv_in_path, nb_frames, frame_width, frame_height, file_prefix) = (
                 self.convert_input_to_yuv(input=x, file_prefix=file_prefix)
@@ -414,39 +568,69 @@ class VTM(nn.Module):
             if self.fpn_sizes_json_dump:
                 self.dump_fpn_sizes_json(file_prefix, bitstream_name, codec_output_dir)
 
-            # normalization wrt to the bitdepth of the input to VTM
-            minv, maxv = self.min_max_dataset
-            frames, mid_level = min_max_normalization(
-                frames, minv, maxv, bitdepth=input_bitdepth
+            nb_frames, frame_height, frame_width = frames.size()
+            input_bitdepth = self.enc_cfgs["input_bitdepth"]
+            chroma_format = self.enc_cfgs["chroma_format"]
+            file_prefix = f"{file_prefix}_{frame_width}x{frame_height}_{self.frame_rate}fps_{input_bitdepth}bit_p{chroma_format}"
+            yuv_in_path = f"{file_prefix}_input.yuv"
+            yuv_width, yuv_height = readwriteYUV._compute_new_frame_resolution(
+                frame_width, frame_height, self.yuvio.resolution_multiple_of_
             )
+            yuv_size = nb_frames * yuv_height * yuv_width * ((input_bitdepth + 7) // 8)
+
+            yuv_cached = False
+            if self.yuv_cache_dir is not None:
+                # the packed features are the same for all the qps, they are
+                # quantized and written once, to a yuv shared by all the encodings
+                yuv_in_path = self._get_yuv_cache_path(
+                    yuv_in_path, bitstream_name, frames
+                )
+                yuv_cached = (
+                    os.path.isfile(yuv_in_path)
+                    and os.path.getsize(yuv_in_path) == yuv_size
+                )
+                if yuv_cached:
+                    print(f"Using cached YUV file: {yuv_in_path}")
+            elif not self.dump["dump_yuv_input"]:
+                yuv_in_path = str(self._get_tmp_yuv_path(yuv_in_path, yuv_size))
 
-            num_frames, *_ = frames.shape
+            # normalization wrt to the bitdepth of the input to VTM
+            # frames is a freshly packed tensor, so it is quantized in place
+            minv, maxv = self.min_max_dataset
+            if not yuv_cached:
+                frames, mid_level = min_max_normalization(
+                    frames, minv, maxv, bitdepth=input_bitdepth, inplace=True
+                )
 
             # Same minv, maxv for all frames.
-            for _ in range(num_frames):
-                frame_info = {
-                    "minv": minv,
-                    "maxv": maxv,
-                }
-                self._frame_info_buffer.append(frame_info)
+            self._frame_info = {
+                "minv": minv,
+                "maxv": maxv,
+            }
+            self._num_frame_infos = nb_frames
 
             conversion_time = time.time() - start
             self.logger.debug(f"conversion time:{conversion_time}")
 
-            nb_frames, frame_height, frame_width = frames.size()
-            input_bitdepth = self.enc_cfgs["input_bitdepth"]
-            chroma_format = self.enc_cfgs["chroma_format"]
-            file_prefix = f"{file_prefix}_{frame_width}x{frame_height}_{self.frame_rate}fps_{input_bitdepth}bit_p{chroma_format}"
-            yuv_in_path = f"{file_prefix}_input.yuv"
+            if stream_input:
+                yuv_in_path = "/dev/stdin"
+            elif not yuv_cached:
+                # a cached yuv only appears once complete, for concurrent encodings
+                write_path = yuv_in_path
+                if self.yuv_cache_dir is not None:
+                    write_path = f"{yuv_in_path}.{os.getpid()}.tmp"
+
+                self.yuvio.setWriter(
+                    write_path=write_path,
+                    frmWidth=frame_width,
+                    frmHeight=frame_height,
+                )
 
-            self.yuvio.setWriter(
-                write_path=yuv_in_path,
-                frmWidth=frame_width,
-                frmHeight=frame_height,
-            )
+                self.yuvio.write_multiple_frames(frames, mid_level=mid_level)
+                self.yuvio.closeWriter()
 
-            for frame in frames:
-                self.yuvio.write_one_frame(frame, mid_level=mid_level)
+                if write_path != yuv_in_path:
+                    os.replace(write_path, yuv_in_path)
 
         bitstream_path = Path(f"{file_prefix}.bin")
         logpath = Path(f"{file_prefix}_enc.log")
@@ -464,55 +648,88 @@ class VTM(nn.Module):
             hash_check=self.hash_check,
         )
 
-        start = time.time()
-        if len(cmds) > 1:  # post parallel encoding
-            run_cmdlines_parallel(cmds, logpath=logpath)
-        else:
-            run_cmdline(cmds[0], logpath=logpath)
-        enc_time = time.time() - start
-        self.logger.debug(f"enc_time:{enc_time}")
-
-        if len(cmds) > 1:  # post parallel encoding
-            cmd, list_of_bitstreams = self.get_parcat_cmd(bitstream_path)
-            run_cmdline(cmd)
+        def write_frames_to(stdin):
+            if remote_inference:
+                run_cmdline_to_output(convert_cmd, stdin)
+                return
+            self.yuvio.setWriter(
+                write_path=stdin,
+                frmWidth=frame_width,
+                frmHeight=frame_height,
+            )
+            self.yuvio.write_multiple_frames(frames, mid_level=mid_level)
+            self.yuvio.closeWriter()
 
-            if self.stash_outputs:
-                for partial in list_of_bitstreams:
-                    Path(partial).unlink()
+        keep_yuv = self.yuv_cache_dir is not None and not remote_inference
+        remove_yuv = (
+            not self.dump["dump_yuv_input"] and not stream_input and not keep_yuv
+        )
 
-        assert Path(
-            bitstream_path
-        ).is_file(), f"bitstream {bitstream_path} was not created"
+        try:
+            start = time.time()
+            if len(cmds) > 1:  # post parallel encoding
+                run_cmdlines_parallel(
+                    cmds,
+                    logpath=logpath,
+                    max_workers=self.parallel_workers,
+                    cores_per_worker=self.cores_per_worker,
+                )
+            elif stream_input:
+                # the encoder starts while the frames are still being written
+                run_cmdline_with_input(cmds[0], write_frames_to, logpath=logpath)
+            else:
+                run_cmdline(cmds[0], logpath=logpath)
+            enc_time = time.time() - start
+            self.logger.debug(f"enc_time:{enc_time}")
+
+            if len(cmds) > 1:  # post parallel encoding
+                cmd, list_of_bitstreams = self.get_parcat_cmd(bitstream_path)
+                run_cmdline(cmd)
+
+                if self.stash_outputs:
+                    for partial in list_of_bitstreams:
+                        partial.unlink()
+        finally:
+            # the temporary yuv (possibly in a tmpfs) is removed even if encoding fails
+            if remove_yuv:
+                Path(yuv_in_path).unlink(missing_ok=True)
+
+        bitstream_stat = bitstream_path.stat()
+        assert stat.S_ISREG(
+            bitstream_stat.st_mode
+        ), f"bitstream {bitstream_path} was not created"
+        bitstream_size = bitstream_stat.st_size
 
         if not remote_inference:
-            inner_codec_bitstream = load_bitstream(bitstream_path)
-
             sequence_info = {
                 "bitdepth": output_bitdepth,
                 "frame_size": (frame_height, frame_width),
                 "num_frames": nb_frames,
             }
 
-            assert sequence_info["num_frames"] == len(self._frame_info_buffer)
-
-            # Bistream header to make bitstream self-decodable
-            fd = self._temp_io_buffer
-            self._header_writer.write_sequence_info(fd, sequence_info)
-            for frame_info in self._frame_info_buffer:
-                self._header_writer.write_frame_info(fd, frame_info)
+            assert sequence_info["num_frames"] == self._num_frame_infos
 
-            pre_info_bitstream = self.get_io_buffer_contents()
-            bitstream = pre_info_bitstream + inner_codec_bitstream
+            # Bistream header to make bitstream self-decodable,
+            # followed by the inner codec bitstream
+            bitstream_path_tmp = f"{file_prefix}_hdr_tmp.bin"
+            with open(bitstream_path_tmp, "wb") as fw:
+                header_size = self._header_writer.write_sequence_info(fw, sequence_info)
+                header_size += self._header_writer.write_frame_infos(
+                    fw, self._frame_info, self._num_frame_infos
+                )
+                with open(bitstream_path, "rb") as fr:
+                    copy_file_tail(fr, fw, 0)
 
-            with open(bitstream_path, "wb") as fw:
-                fw.write(bitstream)
+            os.replace(bitstream_path_tmp, bitstream_path)
+            bitstream_size += header_size
 
-        if not self.dump["dump_yuv_input"]:
-            Path(yuv_in_path).unlink()
+        if self.dump["dump_yuv_input"] or keep_yuv:
+            # the dumped yuv is kept on disk, not in the page cache
+            advise_file_access(yuv_in_path, "dontneed")
 
         # to be compatible with the pipelines
         # per frame bits can be collected by parsing enc log to be more accurate
-        avg_bytes_per_frame = get_filesize(bitstream_path) / nb_frames
+        avg_bytes_per_frame = bitstream_size / nb_frames
         all_bytes_per_frame = [avg_bytes_per_frame] * nb_frames
 
         output = {
@@ -617,60 +834,87 @@ class VTM(nn.Module):
 
             bitstream_fd = self.open_bitstream_file(bitstream_path, "rb")
 
-            # read header bitstream header
-            sequence_info = self._header_reader.read_sequence_info(bitstream_fd)
-            frame_infos = [
-                self._header_reader.read_frame_info(bitstream_fd)
-                for _ in range(sequence_info["num_frames"])
-            ]
+            # read header bitstream header, parsed in place from a memory map
+            with mmap.mmap(
+                bitstream_fd.fileno(), 0, access=mmap.ACCESS_READ
+            ) as header_buf:
+                sequence_info = self._header_reader.read_sequence_info(header_buf)
+                frame_infos = self._header_reader.read_frame_infos(
+                    header_buf, sequence_info["num_frames"]
+                )
+                header_size = header_buf.tell()
             bitdepth = sequence_info["bitdepth"]
             frame_height, frame_width = sequence_info["frame_size"]
+            stream_output = (
+                self.stream_yuv_output and not self.dump["dump_yuv_packing_dec"]
+            )
+            remove_yuv = not self.dump["dump_yuv_packing_dec"] and not stream_output
+            if remove_yuv:
+                yuv_dec_path = self._get_tmp_yuv_path(
+                    yuv_dec_path,
+                    sequence_info["num_frames"]
+                    * frame_height
+                    * frame_width
+                    * ((bitdepth + 7) // 8),
+                )
 
             # we need this to read the std codec part of the bitstream
             with open(bitstream_path_tmp, "wb") as fw:
-                fw.write(bitstream_fd.read())
-                fw.flush()
-
-            cmd = self.get_decode_cmd(
-                bitstream_path=bitstream_path_tmp,
-                yuv_dec_path=yuv_dec_path,
-                output_bitdepth=bitdepth,
-            )
-            self.logger.debug(cmd)
-
-            start = time_measure()
-            run_cmdline(cmd, logpath=logpath)
-            dec_time = time_measure() - start
-            self.logger.debug(f"dec_time:{dec_time}")
-
-            self.yuvio.setReader(
-                read_path=str(yuv_dec_path),
-                frmWidth=frame_width,
-                frmHeight=frame_height,
-            )
-
-            # TODO (fracape) expects raw yuv400 coded on 8 or 16 bit
-            factor = int((bitdepth + 7) / 8)
-            nb_frames = get_filesize(yuv_dec_path) // (
-                frame_width * frame_height * factor
-            )
-
-            rec_frames = []
-            for i in range(nb_frames):
-                rec_yuv = self.yuvio.read_one_frame(i)
-                rec_frames.append(rec_yuv)
+                copy_file_tail(bitstream_fd, fw, header_size)
+            self.close_bitstream_file()
+
+            def get_decode_cmd_to(output_path):
+                cmd = self.get_decode_cmd(
+                    bitstream_path=bitstream_path_tmp,
+                    yuv_dec_path=output_path,
+                    output_bitdepth=bitdepth,
+                )
+                self.logger.debug(cmd)
+                return cmd
+
+            def read_frames_from(output):
+                self.yuvio.setReader(
+                    read_path=output,
+                    frmWidth=frame_width,
+                    frmHeight=frame_height,
+                )
+                return self.yuvio.read_multiple_frames(sequence_info["num_frames"])
+
+            try:
+                start = time_measure()
+                if stream_output:
+                    # the decoded frames are read (and converted) as they are decoded
+                    rec_frames = run_cmdline_with_output(
+                        get_decode_cmd_to, read_frames_from, logpath=logpath
+                    )
+                else:
+                    run_cmdline(get_decode_cmd_to(yuv_dec_path), logpath=logpath)
+                dec_time = time_measure() - start
+                self.logger.debug(f"dec_time:{dec_time}")
+
+                if not stream_output:
+                    self.yuvio.setReader(
+                        read_path=str(yuv_dec_path),
+                        frmWidth=frame_width,
+                        frmHeight=frame_height,
+                    )
 
-            rec_frames = torch.stack(rec_frames)
+                    # all the decoded frames, counted from the size of the opened file
+                    rec_frames = self.yuvio.read_multiple_frames()
+            finally:
+                # the temporary decoded yuv is removed even when decoding fails
+                if remove_yuv:
+                    Path(yuv_dec_path).unlink(missing_ok=True)
 
             start = time_measure()
             minv, maxv = self.min_max_dataset
-            tol = dict(rel_tol=1e-4, abs_tol=1e-4)
-            assert all(
-                math.isclose(frame_info["minv"], minv, **tol)
-                and math.isclose(frame_info["maxv"], maxv, **tol)
-                for frame_info in frame_infos
+            tol = dict(rtol=1e-4, atol=1e-4)
+            assert np.allclose(frame_infos["minv"], minv, **tol)
+            assert np.allclose(frame_infos["maxv"], maxv, **tol)
+            # rec_frames is freshly read from the decoded yuv, restored in place
+            rec_frames = min_max_inv_normalization(
+                rec_frames, minv, maxv, bitdepth=10, inplace=True
             )
-            rec_frames = min_max_inv_normalization(rec_frames, minv, maxv, bitdepth=10)
 
             # (fracape) should feature sizes be part of bitstream?
             thisdir = Path(__file__).parent
@@ -682,12 +926,7 @@ class VTM(nn.Module):
                 fpn_sizes = thisdir.joinpath(
                     f"../../data/mpeg-fcm/{self.datacatalog}/fpn-sizes/{self.dataset_name}.json"
                 )
-            with fpn_sizes.open("r") as f:
-                try:
-                    json_dict = json.load(f)
-                except json.decoder.JSONDecodeError as err:
-                    print(f'Error reading file "{fpn_sizes}"')
-                    raise err
+            json_dict = load_fpn_sizes(str(fpn_sizes))
 
             features = self.fpn_utils.reshape_frame_to_feature_pyramid(
                 rec_frames,
@@ -699,8 +938,9 @@ class VTM(nn.Module):
             conversion_time = time_measure() - start
             self.logger.debug(f"conversion_time:{conversion_time}")
 
-            if not self.dump["dump_yuv_packing_dec"]:
-                yuv_dec_path.unlink()
+            if self.dump["dump_yuv_packing_dec"]:
+                # the dumped yuv is kept on disk, not in the page cache
+                advise_file_access(yuv_dec_path, "dontneed")
             if self.stash_outputs:
                 Path(bitstream_path_tmp).unlink()
 
@@ -715,9 +955,6 @@ class VTM(nn.Module):
 
         return output, dec_times, mac_calculations
 
-    def get_io_buffer_contents(self):
-        return self._temp_io_buffer.getvalue()
-
 
 @register_codec("hm")
 class HM(VTM):
@@ -766,41 +1003,36 @@ class HM(VTM):
         if output_bitdepth == 0:
             output_bitdepth = input_bitdepth
 
-        decodingRefreshType = 1 if self.intra_period >= 1 else 0
         base_cmd = [
-            self.encoder_path,
+            f"{self.encoder_path}",
             "-i",
-            inp_yuv_path,
+            f"{inp_yuv_path}",
             "-c",
-            self.cfg_file,
+            f"{self.cfg_file}",
             "-q",
-            qp,
+            f"{qp}",
             "-o",
             "/dev/null",
             "-wdt",
-            width,
+            f"{width}",
             "-hgt",
-            height,
+            f"{height}",
             "-fr",
-            self.frame_rate,
+            f"{self.frame_rate}",
             "-ts",  # temporal subsampling to prevent default period of 8 in all intra
             "1",
-            f"--Level={level}",
-            f"--IntraPeriod={self.intra_period}",
-            f"--InputChromaFormat={chroma_format}",
-            f"--InputBitDepth={input_bitdepth}",
-            f"--InternalBitDepth={output_bitdepth}",
-            "--ConformanceWindowMode=1",  # needed?
-            f"--DecodingRefreshType={decodingRefreshType}",
+            *self._get_static_cmd_args(
+                level, chroma_format, input_bitdepth, output_bitdepth
+            ),
+            self._decoding_refresh_type_arg,
         ]
 
         if parallel_encoding is False or nb_frames <= self.intra_period + 1:
             # No need for parallel encoding.
             base_cmd.append(f"--BitstreamFile={bitstream_path}")
             base_cmd.append(f"--FramesToBeEncoded={nb_frames}")
-            cmd = list(map(str, base_cmd))
-            self.logger.debug(cmd)
-            cmds = [cmd]
+            self.logger.debug(base_cmd)
+            cmds = [base_cmd]
         else:
             cmds = self._parallel_encode_cmd(base_cmd, bitstream_path, nb_frames)
 
@@ -860,11 +1092,11 @@ class JM(VTM):
 
         # decodingRefreshType = 1 if self.intra_period >= 1 else 0
         cmd = [
-            self.encoder_path,
+            f"{self.encoder_path}",
             "-d",
-            self.default_cfg_file,
+            f"{self.default_cfg_file}",
             "-f",
-            self.cfg_file,
+            f"{self.cfg_file}",
             "-p",
             f"InputFile={inp_yuv_path}",
             "-p",
@@ -898,7 +1130,6 @@ class JM(VTM):
             "-p",
             f"LevelIDC={level}",
         ]
-        cmd = list(map(str, cmd))
         self.logger.debug(cmd)
         return [cmd]
 
@@ -940,9 +1171,14 @@ class VVENC(VTM):
         width: int,
         height: int,
         nb_frames: int = 1,
+        parallel_encoding: bool = False,
+        hash_check: int = 0,
+        chroma_format: str = "420",
+        input_bitdepth: int = 10,
+        output_bitdepth: int = 0,
     ) -> List[Any]:
         """
-        Generate a command to encode a YUV video file using VVENCs.
+        Generate the commands to encode a YUV video file using VVENCs.
         Args:
             inp_yuv_path (Path): The path to the input YUV video file.
             qp (int): The quantization parameter for the encoding process.
@@ -950,29 +1186,59 @@ class VVENC(VTM):
             width (int): The width of the video frame.
             height (int): The height of the video frame.
             nb_frames (int, optional): The number of frames to encode (default is 1).
+            parallel_encoding (bool, optional): Whether to encode intra periods in parallel jobs. Defaults to False.
+            hash_check (int, optional): Unused, kept for compatibility with VTM. Defaults to 0.
+            chroma_format (str, optional): Unused, the input format is yuv420_10. Defaults to "420".
+            input_bitdepth (int, optional): Unused, the input format is yuv420_10. Defaults to 10.
+            output_bitdepth (int, optional): Unused, the input format is yuv420_10. Defaults to 0.
         Returns:
-            List[Any]: A list of strings representing the encoding command.
+            List[Any]: A list of encoding commands, one per parallel job.
         """
-        cmd = [
-            self.encoder_path,
+        base_cmd = [
+            f"{self.encoder_path}",
             "-i",
-            inp_yuv_path,
+            f"{inp_yuv_path}",
             "-q",
-            qp,
-            "--output",
-            bitstream_path,
+            f"{qp}",
             "--size",
             f"{width}x{height}",
             "--framerate",
-            self.frame_rate,
-            "--frames",
-            nb_frames,
+            f"{self.frame_rate}",
             "--format",
             "yuv420_10",
             "--preset",
             "fast",
         ]
-        return list(map(str, cmd))
+
+        if parallel_encoding is False or nb_frames <= self.intra_period + 1:
+            # No need for parallel encoding.
+            cmd = [*base_cmd, *self._segment_cmd_args(bitstream_path, 0, nb_frames)]
+            self.logger.debug(cmd)
+            cmds = [cmd]
+        else:
+            # the segments are cut every intra period, where vvenc must place an
+            # IDR picture (closed GOP), so that the stitched bitstream is valid
+            base_cmd += [
+                "--intraperiod",
+                f"{self.intra_period}",
+                "--refreshtype",
+                "idr",
+            ]
+            cmds = self._parallel_encode_cmd(base_cmd, bitstream_path, nb_frames)
+
+        return cmds
+
+    def _segment_cmd_args(
+        self, bitstream_path, frame_skip: int, frames_to_be_encoded: int
+    ) -> List[str]:
+        return [
+            "--output",
+            f"{bitstream_path}",
+            "--frameskip",
+            f"{frame_skip}",
+            "--frames",
+            f"{frames_to_be_encoded}",
+        ]
 
 
 @register_codec("vcmrs")
@@ -1180,9 +1446,8 @@ class VCMRS(VTM):
             cmd.append("--" + c)
             cmd.append(str(cfg[c]))
 
-        cmd.append(inp_yuv_path)
+        cmd.append(f"{inp_yuv_path}")
 
-        cmd = list(map(str, cmd))
         return [cmd]
 
     def get_decode_cmd(
@@ -1203,7 +1468,7 @@ class VCMRS(VTM):
             sys.executable,
             "-m",
             "vcmrs.decoder",
-            bitstream_path,
+            f"{bitstream_path}",
             "--working_dir",
             os.path.join(output_dir, "working_dir"),  # self.tmp_dir,
             "--InnerCodec",
@@ -1213,7 +1478,6 @@ class VCMRS(VTM):
             # "-d",
             # output_bitdepth,
         ]
-        cmd = list(map(str, cmd))
         self.logger.debug(cmd)
         return cmd
 
@@ -1252,6 +1516,16 @@ class HeaderWriter:
             ]
         )
 
+    def write_frame_infos(self, fd, frame_info, num_frames):
+        """writes the same frame info for num_frames frames at once"""
+        expected_keys = [
+            "minv",
+            "maxv",
+        ]
+        assert set(frame_info.keys()) == set(expected_keys)
+
+        return write_float32(fd, (frame_info["minv"], frame_info["maxv"]) * num_frames)
+
 
 class HeaderReader:
     def __init__(self):
@@ -1288,33 +1562,40 @@ class HeaderReader:
 
         return frame_info
 
+    def read_frame_infos(self, fd, num_frames):
+        """reads the info of num_frames frames at once, as arrays of per-frame values"""
+        values = np.array(read_float32(fd, 2 * num_frames)).reshape(num_frames, 2)
 
-def _distribute_parallel_work(num_frames: int, num_workers: int, intra_period: int):
-    """Distributes frame encoding work.
+        frame_infos = {
+            "frame_id": np.arange(num_frames) + self._num_frames_read,
+            "minv": values[:, 0],
+            "maxv": values[:, 1],
+        }
 
-    worker[i] is to be assigned frames in the interval
-    [offsets[i], offsets[i] + counts[i]).
-    """
-    offsets = []
-    counts = []
+        self._num_frames_read += num_frames
 
-    offset = 0
-    num_remaining = num_frames
+        return frame_infos
 
-    # WARN: Current implementation assumes one worker per intra period.
-    # assert num_workers == num_frames // intra_period
 
-    for _ in range(num_workers):
-        assert num_remaining > 0
+def _distribute_parallel_work(num_frames: int, intra_period: int):
+    """Distributes frame encoding work, one job per intra period.
 
-        # NOTE: The first and last frames must both be intra-frames, hence the +1.
-        count = min(intra_period + 1, num_remaining)
+    job[i] is to be assigned frames in the interval
+    [offsets[i], offsets[i] + counts[i]).
+    Jobs are meant to be pulled from a queue by a pool of workers, so that a
+    worker done with a fast intra period immediately takes the next one.
+    """
+    # NOTE: The first and last frames must both be intra-frames, hence the +1,
+    # i.e., consecutive jobs share the intra frame at their boundary.
+    num_jobs = max(math.ceil((num_frames - 1) / intra_period), 1)
 
-        offsets.append(offset)
-        counts.append(count)
+    offsets = []
+    counts = []
 
-        offset += intra_period
-        num_remaining -= intra_period
+    for job_idx in range(num_jobs):
+        offset = job_idx * intra_period
+        offsets.append(offset)
+        counts.append(min(intra_period + 1, num_frames - offset))
 
     assert offsets[-1] + counts[-1] == num_frames
 
@@ -27,9 +27,12 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import configparser
 import json
 import math
+import os
 
+from functools import lru_cache
 from typing import Dict
 
 import torch
@@ -37,6 +40,11 @@ import torch.nn.functional as F
 
 from torch import Tensor
 
+try:
+    from orjson import loads as json_loads  # faster, if installed
+except ImportError:
+    json_loads = json.loads
+
 MIN_MAX_DATASET = {
     # "mpeg-oiv6-detection": (
     #    -26.426828384399414,
@@ -55,14 +63,63 @@ MIN_MAX_DATASET = {
 }
 
 
-def min_max_normalization(x, min: float, max: float, bitdepth: int = 10):
+def _mtime_ns(path: str) -> int:
+    # part of the cache keys below, so that a modified file is read again
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+@lru_cache(maxsize=64)
+def _read_seqinfo_frame_rate(seqinfo_path: str, mtime_ns: int) -> str:
+    config = configparser.ConfigParser()
+    config.read(seqinfo_path)
+    return config["Sequence"]["frameRate"]
+
+
+def read_frame_rate_from_seqinfo(seqinfo_path: str) -> str:
+    """reads (once per version of the file) the frame rate of a sequence from its seqinfo.ini"""
+    return _read_seqinfo_frame_rate(seqinfo_path, _mtime_ns(seqinfo_path))
+
+
+@lru_cache(maxsize=128)
+def _load_json_file(path: str, mtime_ns: int) -> Dict:
+    with open(path, "rb") as f:
+        try:
+            return json_loads(f.read())
+        except json.decoder.JSONDecodeError as err:  # also raised by orjson
+            print(f'Error reading file "{path}"')
+            raise err
+
+
+def load_fpn_sizes(fpn_sizes_path: str) -> Dict:
+    """loads (once per version of the file) the json file of fpn sizes used to unpack the features"""
+    return _load_json_file(fpn_sizes_path, _mtime_ns(fpn_sizes_path))
+
+
+def min_max_normalization(
+    x, min: float, max: float, bitdepth: int = 10, inplace: bool = False
+):
+    # NOTE: the order of operations (subtract, divide, clamp, multiply, floor)
+    # is what the anchor bitstreams were produced with. Folding it into a single
+    # scale and offset, or rounding instead of flooring, changes some samples.
     max_num_bins = (2**bitdepth) - 1
-    out = ((x - min) / (max - min)).clamp_(0, 1)
     mid_level = -min / (max - min)
-    return (out * max_num_bins).floor(), int(mid_level * max_num_bins + 0.5)
+    if inplace:
+        # same sequence of operations in a single pass over x, no temporaries
+        out = x.sub_(min).div_(max - min).clamp_(0, 1).mul_(max_num_bins).floor_()
+    else:
+        out = (((x - min) / (max - min)).clamp_(0, 1) * max_num_bins).floor()
+    return out, int(mid_level * max_num_bins + 0.5)
 
 
-def min_max_inv_normalization(x, min: float, max: float, bitdepth: int = 10):
+def min_max_inv_normalization(
+    x, min: float, max: float, bitdepth: int = 10, inplace: bool = False
+):
+    if inplace:
+        # same sequence of operations in a single pass over x, no temporaries
+        return x.div_((2**bitdepth) - 1).mul_(max - min).add_(min)
     out = x / ((2**bitdepth) - 1)
     out = (out * (max - min)) + min
     return out
@@ -107,14 +107,25 @@ def create_dataloader(conf: DictConfig, device: str, cfg: Any = None) -> DataLoa
 
     dataset = create_dataset(conf.type, args)
 
+    num_workers = conf["loader"].num_workers
+    worker_args = {}
+    if num_workers > 0:
+        # keep the workers (and their decoded frames) alive between the passes
+        # of a pipeline over the dataloader
+        worker_args = {
+            "persistent_workers": conf["loader"].get("persistent_workers", False),
+            "prefetch_factor": conf["loader"].get("prefetch_factor", 2),
+        }
+
     return DataLoader(
         dataset,
         batch_size=conf["loader"].batch_size,
-        num_workers=conf["loader"].num_workers,
+        num_workers=num_workers,
         sampler=dataset.sampler,
         collate_fn=dataset.collate_fn,
         shuffle=conf["loader"].shuffle,
         pin_memory=(device == "cuda"),
+        **worker_args,
     )
 
 
@@ -42,6 +42,10 @@ class BaseWrapper(nn.Module):
     An instance of this class helps you to wrap an off-the-shelf model so that the wrapped model can behave in various modes such as "full" and "partial" to process the input frames.
     """
 
+    # whether features_to_output accepts the features of several frames of the
+    # same size at once, and then returns one result per frame
+    supports_batched_features = False
+
     def __init__(self, device) -> None:
         super().__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
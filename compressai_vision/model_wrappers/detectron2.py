@@ -26,11 +26,17 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import copy
+import hashlib
+import os
 import re
+import threading
 
+from collections import namedtuple
+from contextlib import nullcontext
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import torch
 
@@ -54,6 +60,19 @@ __all__ = [
 thisdir = Path(__file__).parent
 root_path = thisdir.joinpath("../..")
 
+# autocast dtypes of the supported inference precisions (None: no autocast)
+PRECISION_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+# the only attribute of detectron2's ImageList read by the proposal generator and
+# the roi heads, when they run from the features
+ImageSizes = namedtuple("ImageSizes", ["image_sizes"])
+
+# models built and loaded with their weights on cpu, keyed by the hash of the
+# model config and the weights file (and its modification time), to be copied
+# by the wrappers created afterwards in the same process
+_MODEL_CACHE: Dict[Tuple[str, str, int], torch.nn.Module] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
 
 # reference Conv2D from detectron2/detercon2/layers/wrappers.py
 class Conv2d(IntConv2d):
@@ -142,6 +161,115 @@ class ConvTranspose2d(IntTransposedConv2d):
         return x
 
 
+class CudaGraphModule:
+    """
+    Runs a module by replaying a CUDA graph of its forward, captured at the first
+    call with each input shape, which removes the launch overhead of its many
+    small kernels. The module must return a dict of tensors.
+    """
+
+    def __init__(self, module: torch.nn.Module, num_warmup: int = 3):
+        self.module = module
+        self.num_warmup = num_warmup
+        self._graph = None
+        self._static_in = None
+        self._static_out = None
+
+    def _capture(self, x: torch.Tensor):
+        self._static_in = torch.empty_like(x)
+        self._static_in.copy_(x)
+
+        # warm up on a side stream, as required before capturing
+        side_stream = torch.cuda.Stream(x.device)
+        side_stream.wait_stream(torch.cuda.current_stream(x.device))
+        with torch.cuda.stream(side_stream):
+            for _ in range(self.num_warmup):
+                self.module(self._static_in)
+        torch.cuda.current_stream(x.device).wait_stream(side_stream)
+
+        self._graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._graph):
+            self._static_out = self.module(self._static_in)
+
+    def __call__(self, x: torch.Tensor) -> Dict:
+        if (
+            self._graph is None
+            or x.shape != self._static_in.shape
+            or x.dtype != self._static_in.dtype
+            or x.stride() != self._static_in.stride()
+        ):
+            self._capture(x)
+        else:
+            self._static_in.copy_(x)
+        self._graph.replay()
+
+        # the static outputs are overwritten by the next replay
+        return {k: v.clone() for k, v in self._static_out.items()}
+
+
+class CompiledModule:
+    """
+    Runs a module compiled with torch.compile in reduce-overhead mode, which
+    replays CUDA graphs whose static outputs are overwritten by the next call,
+    so the outputs are copied before being returned. The module must return a
+    dict of tensors.
+    """
+
+    def __init__(self, module: torch.nn.Module):
+        self.module = module
+        # dynamic shapes are only compiled when the input size changes
+        self._compiled = torch.compile(module, mode="reduce-overhead", dynamic=None)
+
+    def __call__(self, x: torch.Tensor) -> Dict:
+        # marks the start of a new iteration of the graphs (not in torch 2.0)
+        if hasattr(torch.compiler, "cudagraph_mark_step_begin"):
+            torch.compiler.cudagraph_mark_step_begin()
+        out = self._compiled(x)
+        return {k: v.clone() for k, v in out.items()}
+
+
+class OnnxModule:
+    """
+    Runs a module with ONNX Runtime on cpu, from its ONNX export at onnx_path
+    (exported from the module if the file does not exist yet). The module must
+    take an image tensor and return a dict of tensors.
+    """
+
+    PROVIDERS = ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+
+    def __init__(self, module: torch.nn.Module, onnx_path: str, example_input):
+        try:
+            import onnxruntime
+        except ImportError as err:
+            raise ImportError("onnxruntime is required to run an ONNX model") from err
+
+        with torch.no_grad():
+            self.output_names = list(module(example_input).keys())
+
+        if not os.path.isfile(onnx_path):
+            torch.onnx.export(
+                module,
+                (example_input,),
+                onnx_path,
+                input_names=["images"],
+                output_names=self.output_names,
+                dynamic_axes={"images": {0: "N", 2: "H", 3: "W"}},
+                opset_version=17,
+            )
+
+        available_providers = onnxruntime.get_available_providers()
+        self.session = onnxruntime.InferenceSession(
+            onnx_path,
+            providers=[p for p in self.PROVIDERS if p in available_providers],
+        )
+
+    def __call__(self, x: torch.Tensor) -> Dict:
+        outputs = self.session.run(
+            self.output_names, {"images": x.float().contiguous().numpy()}
+        )
+        return {k: torch.from_numpy(v) for k, v in zip(self.output_names, outputs)}
+
+
 class Split_Points(Enum):
     def __str__(self):
         return str(self.value)
@@ -152,6 +280,8 @@ class Split_Points(Enum):
 
 
 class Rcnn_R_50_X_101_FPN(BaseWrapper):
+    supports_batched_features = True
+
     def __init__(self, device: str, **kwargs):
         from detectron2.checkpoint import DetectionCheckpointer
         from detectron2.config import get_cfg
@@ -171,14 +301,9 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         self._cfg.merge_from_file(f"{_path_prefix}/{kwargs['cfg']}")
         _integer_conv_weight = bool(kwargs["integer_conv_weight"])
 
-        self.model = self.build_model(self._cfg)
-        self.replace_conv2d_modules(self.model)
+        self.model = self._load_model(f"{_path_prefix}/{kwargs['weights']}")
         self.model = self.model.to(device).eval()
 
-        self.DetectionCheckpointer(self.model).load(
-            f"{_path_prefix}/{kwargs['weights']}"
-        )
-
         for param in self.model.parameters():
             param.requires_grad = False
 
@@ -186,7 +311,44 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         if _integer_conv_weight:
             self.mode = self.quantize_weights(self.model)
 
+        # optional mixed precision inference, with the weights kept in fp32
+        precision = kwargs.get("precision", "fp32")
+        assert (
+            precision in PRECISION_DTYPES
+        ), f"Unsupported precision {precision}, expected one of {list(PRECISION_DTYPES)}"
+        self._autocast_dtype = PRECISION_DTYPES[precision]
+        self._autocast_device_type = torch.device(device).type
+
+        # optional NHWC layout of the weights and activations, for faster conv kernels
+        self._memory_format = torch.contiguous_format
+        if kwargs.get("channels_last", False):
+            self._memory_format = torch.channels_last
+            self.model = self.model.to(memory_format=self._memory_format)
+
         self.backbone = self.model.backbone
+        # the backbone computing the feature pyramid in nn part 1, optionally
+        # compiled to fused kernels (self.backbone is still used for its modules)
+        self._backbone_forward = self.backbone
+        if kwargs.get("compile_backbone", False):
+            self._backbone_forward = CompiledModule(self.backbone)
+        elif kwargs.get("cuda_graph", False):
+            if torch.device(device).type == "cuda":
+                self._backbone_forward = CudaGraphModule(self.backbone)
+            else:
+                self.logger.warning(f"cuda_graph is ignored on device {device}")
+        elif kwargs.get("onnx_backbone", None):
+            if torch.device(device).type == "cpu" and not _integer_conv_weight:
+                # any input size divisible by the size divisibility of the backbone
+                example_input = torch.zeros(
+                    1, 3, 8 * self.size_divisibility, 8 * self.size_divisibility
+                )
+                self._backbone_forward = OnnxModule(
+                    self.backbone, kwargs["onnx_backbone"], example_input
+                )
+            else:
+                self.logger.warning(
+                    "onnx_backbone is only used on cpu, without integer_conv_weight"
+                )
         self.top_block = self.model.backbone.top_block
         self.proposal_generator = self.model.proposal_generator
         self.roi_heads = self.model.roi_heads
@@ -212,6 +374,8 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         self.features_at_splits = dict(
             zip(self.split_layer_list, [None] * len(self.split_layer_list))
         )
+        # the split layer names in order, to rename the features received by nn part 2
+        self._split_keys = tuple(self.split_layer_list)
 
         if kwargs.get("hyper_params", {}).get("update", False):
             hyper_params = {
@@ -241,6 +405,32 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
     def size_divisibility(self):
         return self.backbone.size_divisibility
 
+    def _load_model(self, weights_path: str):
+        """
+        Returns a copy of the model built from the config with the weights loaded,
+        which is built and loaded only once per config and weights file
+        """
+        cfg = self._cfg.clone()
+        cfg.MODEL.DEVICE = "cpu"
+        try:
+            mtime_ns = os.stat(weights_path).st_mtime_ns
+        except OSError:
+            mtime_ns = -1
+        key = (hashlib.sha1(cfg.dump().encode()).hexdigest(), weights_path, mtime_ns)
+
+        with _MODEL_CACHE_LOCK:
+            model = _MODEL_CACHE.get(key)
+            if model is None:
+                model = self.build_model(cfg)
+                self.replace_conv2d_modules(model)
+                self.DetectionCheckpointer(model).load(weights_path)
+                _MODEL_CACHE[key] = model.eval()
+            else:
+                self.logger.info(f"Reusing the model loaded from {weights_path}")
+
+            # the wrappers modify their model (quantization, inference overrides)
+            return copy.deepcopy(model)
+
     def replace_conv2d_modules(self, module):
         for child_name, child_module in module.named_children():
             if type(child_module).__name__ in ["Conv2d", "ConvTranspose2d"]:
@@ -286,19 +476,26 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         return ImageList.from_tensors(images, self.size_divisibility)
 
+    def _autocast(self):
+        """context of the inference, in the configured precision"""
+        if self._autocast_dtype is None:
+            return nullcontext()
+        return torch.autocast(self._autocast_device_type, dtype=self._autocast_dtype)
+
     def input_to_features(self, x, device: str) -> Dict:
         """Computes deep features at the intermediate layer(s) all the way from the input"""
 
         self.model = self.model.to(device).eval()
 
-        if self.split_id == self.SPLIT_FPN:
-            return self._input_to_feature_pyramid(x)
-        elif self.split_id == self.SPLIT_C2:
-            return self._input_to_c2(x)
-        elif self.split_id == self.SPLIT_R2:
-            return self._input_to_r2(x)
-        else:
-            self.logger.error(f"Not supported split point {self.split_id}")
+        with self._autocast():
+            if self.split_id == self.SPLIT_FPN:
+                return self._input_to_feature_pyramid(x)
+            elif self.split_id == self.SPLIT_C2:
+                return self._input_to_c2(x)
+            elif self.split_id == self.SPLIT_R2:
+                return self._input_to_r2(x)
+            else:
+                self.logger.error(f"Not supported split point {self.split_id}")
 
         raise NotImplementedError
 
@@ -307,20 +504,36 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         self.model = self.model.to(device).eval()
 
-        if self.split_id == self.SPLIT_FPN:
-            return self._feature_pyramid_to_output(
-                x["data"], x["org_input_size"], x["input_size"], x.get("hyper_params")
-            )
-        elif self.split_id == self.SPLIT_C2:
-            return self._feature_c2_to_output(
-                x["data"], x["org_input_size"], x["input_size"], x.get("hyper_params")
-            )
-        elif self.split_id == self.SPLIT_R2:
-            return self._feature_r2_to_output(
-                x["data"], x["org_input_size"], x["input_size"], x.get("hyper_params")
-            )
-        else:
-            self.logger.error(f"Not supported split points {self.split_id}")
+        if self._memory_format != torch.contiguous_format:
+            x["data"] = {
+                k: v.contiguous(memory_format=self._memory_format)
+                for k, v in x["data"].items()
+            }
+
+        with self._autocast():
+            if self.split_id == self.SPLIT_FPN:
+                return self._feature_pyramid_to_output(
+                    x["data"],
+                    x["org_input_size"],
+                    x["input_size"],
+                    x.get("hyper_params"),
+                )
+            elif self.split_id == self.SPLIT_C2:
+                return self._feature_c2_to_output(
+                    x["data"],
+                    x["org_input_size"],
+                    x["input_size"],
+                    x.get("hyper_params"),
+                )
+            elif self.split_id == self.SPLIT_R2:
+                return self._feature_r2_to_output(
+                    x["data"],
+                    x["org_input_size"],
+                    x["input_size"],
+                    x.get("hyper_params"),
+                )
+            else:
+                self.logger.error(f"Not supported split points {self.split_id}")
 
         raise NotImplementedError
 
@@ -341,7 +554,9 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
     def _input_to_feature_pyramid(self, x):
         """Computes and return feature pyramid ['p2', 'p3', 'p4', 'p5'] all the way from the input"""
         imgs = self.model.preprocess_image(x)
-        feature_pyramid = self.backbone(imgs.tensor)
+        feature_pyramid = self._backbone_forward(
+            imgs.tensor.contiguous(memory_format=self._memory_format)
+        )
         del feature_pyramid["p6"]
 
         return {"data": feature_pyramid, "input_size": imgs.image_sizes}
@@ -357,7 +572,9 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         results = []
 
         # Resnet FPN
-        bottom_up_features = self.backbone.bottom_up(imgs.tensor)
+        bottom_up_features = self.backbone.bottom_up(
+            imgs.tensor.contiguous(memory_format=self._memory_format)
+        )
 
         for idx, lateral_conv in enumerate(self.backbone.lateral_convs):
             features = bottom_up_features[ref_features[-idx - 1]]
@@ -374,7 +591,9 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         imgs = self.model.preprocess_image(x)
 
         # Resnet FPN
-        stem_out = self.backbone.bottom_up.stem(imgs.tensor)
+        stem_out = self.backbone.bottom_up.stem(
+            imgs.tensor.contiguous(memory_format=self._memory_format)
+        )
         r2_out = self.backbone.bottom_up.res2(stem_out)
 
         return {"data": {"r2": r2_out}, "input_size": imgs.image_sizes}
@@ -385,7 +604,7 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         imgs = self.model.preprocess_image(x)
         return imgs.image_sizes
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def _feature_pyramid_to_output(
         self,
         x: Dict,
@@ -404,15 +623,11 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         """
 
-        class dummy:
-            def __init__(self, img_size: list):
-                self.image_sizes = img_size
-
-        cdummy = dummy(input_img_size)
+        cdummy = ImageSizes(input_img_size)
 
         # Replacing tag names for interfacing with NN-part2
-        x = dict(zip(self.features_at_splits.keys(), x.values()))
-        x.update({"p6": self.top_block(x["p5"])[0]})
+        x = dict(zip(self._split_keys, x.values()))
+        x["p6"] = self.top_block(x["p5"])[0]
 
         if hyper_params:
             self._apply_infer_overrides(hyper_params)
@@ -425,13 +640,11 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         ), "Scripting is not supported for postprocess."
         return self.model._postprocess(
             results,
-            [
-                org_img_size,
-            ],
+            [org_img_size] * len(results),
             input_img_size,
         )
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def _feature_c2_to_output(
         self,
         x: Dict,
@@ -450,14 +663,10 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         """
         # Replacing tag names for interfacing with NN-part2
-        x = dict(zip(self.features_at_splits.keys(), x.values()))
+        x = dict(zip(self._split_keys, x.values()))
         x = self.backbone.forward_after_c2(x)
 
-        class dummy:
-            def __init__(self, img_size: list):
-                self.image_sizes = img_size
-
-        cdummy = dummy(input_img_size)
+        cdummy = ImageSizes(input_img_size)
 
         if hyper_params:
             self._apply_infer_overrides(hyper_params)
@@ -470,13 +679,11 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
         ), "Scripting is not supported for postprocess."
         return self.model._postprocess(
             results,
-            [
-                org_img_size,
-            ],
+            [org_img_size] * len(results),
             input_img_size,
         )
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def _feature_r2_to_output(
         self,
         x: Dict,
@@ -500,11 +707,7 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         fptensors = self.backbone(bottom_up_features, no_bottom_up=True)
 
-        class dummy:
-            def __init__(self, img_size: list):
-                self.image_sizes = img_size
-
-        cdummy = dummy(input_img_size)
+        cdummy = ImageSizes(input_img_size)
 
         if hyper_params:
             self._apply_infer_overrides(hyper_params)
@@ -518,9 +721,7 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
 
         return self.model._postprocess(
             results,
-            [
-                org_img_size,
-            ],
+            [org_img_size] * len(results),
             input_img_size,
         )
 
@@ -539,25 +740,22 @@ class Rcnn_R_50_X_101_FPN(BaseWrapper):
             ), f"Input feature tensor dimension is supposed to be 3 or 4, but got {nft.dim()}"
             d[e] = nft.unsqueeze(0) if nft.dim() == 3 else nft
 
-        class dummy:
-            def __init__(self, img_size: list):
-                self.image_sizes = img_size
-
-        cdummy = dummy(x["input_size"])
+        cdummy = ImageSizes(x["input_size"])
 
         # Replacing tag names for interfacing with NN-part2
-        d = dict(zip(self.features_at_splits.keys(), d.values()))
-        d.update({"p6": self.top_block(d["p5"])[0]})
+        d = dict(zip(self._split_keys, d.values()))
+        d["p6"] = self.top_block(d["p5"])[0]
 
         proposals, _ = self.proposal_generator(cdummy, d, None)
 
         return proposals[0]
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def forward(self, x):
         """Complete the downstream task with end-to-end manner all the way from the input"""
         # test
-        return self.model([x])
+        with self._autocast():
+            return self.model([x])
 
     @property
     def cfg(self):
@@ -601,6 +799,8 @@ class mask_rcnn_R_50_FPN_3x(Rcnn_R_50_X_101_FPN):
 
 @register_vision_model("panoptic_rcnn_R_101_FPN_3x")
 class panoptic_rcnn_R_101_FPN_3x(Rcnn_R_50_X_101_FPN):
+    supports_batched_features = False
+
     def __init__(self, device="cpu", **kwargs):
         from detectron2.modeling.meta_arch.panoptic_fpn import (
             combine_semantic_and_instance_outputs,
@@ -624,7 +824,7 @@ class panoptic_rcnn_R_101_FPN_3x(Rcnn_R_50_X_101_FPN):
         self.combine_stuff_area_thresh = combine_stuff_area_thresh
         self.combine_instances_score_thresh = combine_instances_score_thresh
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def _feature_pyramid_to_output(
         self,
         x: Dict,
@@ -643,15 +843,11 @@ class panoptic_rcnn_R_101_FPN_3x(Rcnn_R_50_X_101_FPN):
 
         """
 
-        class dummy:
-            def __init__(self, img_size: list):
-                self.image_sizes = img_size
-
-        cdummy = dummy(input_img_size)
+        cdummy = ImageSizes(input_img_size)
 
         # Replacing tag names for interfacing with NN-part2
-        x = dict(zip(self.features_at_splits.keys(), x.values()))
-        x.update({"p6": self.top_block(x["p5"])[0]})
+        x = dict(zip(self._split_keys, x.values()))
+        x["p6"] = self.top_block(x["p5"])[0]
 
         sem_seg_results, _ = self.sem_seg_head(x, None)
         proposals, _ = self.proposal_generator(cdummy, x, None)
@@ -27,6 +27,7 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import concurrent.futures as cf
 import os
 
 from typing import Dict
@@ -100,7 +101,38 @@ class ImageSplitInference(BasePipeline):
         accum_enc_by_module = None
         accum_dec_by_module = None
 
-        for e, d in enumerate(tqdm(dataloader)):
+        # in encode_only mode, an image can be encoded in the background
+        # while the features of the next one are computed
+        encode_async = self.configs["codec"]["encode_only"] is True
+        encode_async &= bool(self.configs["codec"].get("encode_async", False))
+        encode_executor = cf.ThreadPoolExecutor(max_workers=1) if encode_async else None
+        pending_encodings = []
+
+        def accumulate_encoding(enc_elapsed, enc_time_by_module, enc_complexity):
+            nonlocal accum_enc_by_module
+
+            self.update_time_elapsed("encode", enc_elapsed)
+            if self.is_mac_calculation:
+                self.acc_kmac_and_pixels_info(
+                    "feature_reduction", enc_complexity[0], enc_complexity[1]
+                )
+
+            if accum_enc_by_module is None:
+                accum_enc_by_module = enc_time_by_module
+            else:
+                accum_enc_by_module = dict_sum(accum_enc_by_module, enc_time_by_module)
+
+        # in decode_only mode, the bitstream of the next image can be decoded
+        # in the background while the current one goes through nn part 2
+        decode_async = self.configs["codec"]["decode_only"] is True
+        decode_async &= bool(self.configs["codec"].get("decode_async", False))
+        pending_decodings = {}
+
+        items = tqdm(dataloader)
+        if decode_async:
+            items = self._decode_ahead(items, codec, pending_decodings)
+
+        for e, d in enumerate(items):
             org_img_size = {"height": d[0]["height"], "width": d[0]["width"]}
             file_prefix = f"img_id_{d[0]['image_id']}"
 
@@ -128,56 +160,43 @@ class ImageSplitInference(BasePipeline):
                 }
                 featureT["org_input_size"] = org_img_size
 
-                start = time_measure()
-                res, enc_time_by_module, enc_complexity = self._compress(
+                compress_args = (
                     codec,
                     featureT,
                     self.codec_output_dir,
                     self.bitstream_name,
                     file_prefix,
                 )
-                self.update_time_elapsed("encode", (time_measure() - start))
-                if self.is_mac_calculation:
-                    self.acc_kmac_and_pixels_info(
-                        "feature_reduction", enc_complexity[0], enc_complexity[1]
+                if encode_async:
+                    pending_encodings.append(
+                        encode_executor.submit(self._timed_compress, *compress_args)
                     )
+                    # a single encoding in flight while the next features are computed
+                    while len(pending_encodings) > 1:
+                        _, *enc_results = pending_encodings.pop(0).result()
+                        accumulate_encoding(*enc_results)
+                    continue
 
-                if accum_enc_by_module is None:
-                    accum_enc_by_module = enc_time_by_module
-                else:
-                    accum_enc_by_module = dict_sum(
-                        accum_enc_by_module, enc_time_by_module
-                    )
+                res, *enc_results = self._timed_compress(*compress_args)
+                accumulate_encoding(*enc_results)
+            elif decode_async:
+                res, decoding = pending_decodings.pop(file_prefix)
+                *dec_results, dec_elapsed = decoding.result()
             else:
-                res = {}
-                bin_files = [
-                    file_path
-                    for file_path in self.codec_output_dir.glob(
-                        f"{self.bitstream_name}-{file_prefix}*"
-                    )
-                    if (
-                        (file_path.suffix in [".bin", ".mp4"])
-                        and "_tmp" not in file_path.name
-                    )
-                ]
-                assert (
-                    len(bin_files) > 0
-                ), f"Error: decode_only mode, no bitstream file matching {self.bitstream_name}-{file_prefix}*"
-                assert (
-                    len(bin_files) == 1
-                ), f"Error, decode_only mode, multiple bitstream files matching {self.bitstream_name}*"
-
-                res["bitstream"] = bin_files[0]
-                print(f"reading bitstream... {res['bitstream']}")
+                res = {"bitstream": self._find_bitstream(file_prefix)}
 
             if self.configs["codec"]["encode_only"] is True:
                 continue
 
-            start = time_measure()
-            dec_features, dec_time_by_module, dec_complexity = self._decompress(
-                codec, res["bitstream"], self.codec_output_dir, file_prefix
-            )
-            self.update_time_elapsed("decode", (time_measure() - start))
+            if decode_async:
+                dec_features, dec_time_by_module, dec_complexity = dec_results
+            else:
+                start = time_measure()
+                dec_features, dec_time_by_module, dec_complexity = self._decompress(
+                    codec, res["bitstream"], self.codec_output_dir, file_prefix
+                )
+                dec_elapsed = time_measure() - start
+            self.update_time_elapsed("decode", dec_elapsed)
             if self.is_mac_calculation:
                 self.acc_kmac_and_pixels_info(
                     "feature_restoration", dec_complexity[0], dec_complexity[1]
@@ -252,6 +271,12 @@ class ImageSplitInference(BasePipeline):
             out_res["input_size"] = dec_features["input_size"][0]
             output_list.append(out_res)
 
+        if encode_async:
+            for pending_encoding in pending_encodings:
+                _, *enc_results = pending_encoding.result()
+                accumulate_encoding(*enc_results)
+            encode_executor.shutdown()
+
         if not self.configs["codec"]["decode_only"]:
             accum_enc_by_module = {
                 key: accum_enc_by_module[key]
@@ -286,3 +311,66 @@ class ImageSplitInference(BasePipeline):
             eval_performance,
             self.complexity_calc_by_module,
         )
+
+    def _timed_compress(self, *args):
+        """compresses with self._compress and also returns the elapsed time"""
+        start = time_measure()
+        res, enc_time_by_module, enc_complexity = self._compress(*args)
+        return res, (time_measure() - start), enc_time_by_module, enc_complexity
+
+    def _timed_decompress(self, *args):
+        """decompresses with self._decompress and also returns the elapsed time"""
+        start = time_measure()
+        dec_features, dec_time_by_module, dec_complexity = self._decompress(*args)
+        return (
+            dec_features,
+            dec_time_by_module,
+            dec_complexity,
+            (time_measure() - start),
+        )
+
+    def _find_bitstream(self, file_prefix: str):
+        """finds the bitstream of an image to decode in decode_only mode"""
+        bin_files = [
+            file_path
+            for file_path in self.codec_output_dir.glob(
+                f"{self.bitstream_name}-{file_prefix}*"
+            )
+            if ((file_path.suffix in [".bin", ".mp4"]) and "_tmp" not in file_path.name)
+        ]
+        assert (
+            len(bin_files) > 0
+        ), f"Error: decode_only mode, no bitstream file matching {self.bitstream_name}-{file_prefix}*"
+        assert (
+            len(bin_files) == 1
+        ), f"Error, decode_only mode, multiple bitstream files matching {self.bitstream_name}*"
+
+        print(f"reading bitstream... {bin_files[0]}")
+        return bin_files[0]
+
+    def _decode_ahead(self, items, codec, pending_decodings: Dict):
+        """
+        Yields the items, the decoding of each item being started in the background
+        before the previous item is yielded. The results are stored by file prefix
+        in pending_decodings.
+        """
+        with cf.ThreadPoolExecutor(max_workers=1) as decode_executor:
+            previous = None
+            for d in items:
+                file_prefix = f"img_id_{d[0]['image_id']}"
+                res = {"bitstream": self._find_bitstream(file_prefix)}
+                pending_decodings[file_prefix] = (
+                    res,
+                    decode_executor.submit(
+                        self._timed_decompress,
+                        codec,
+                        res["bitstream"],
+                        self.codec_output_dir,
+                        file_prefix,
+                    ),
+                )
+                if previous is not None:
+                    yield previous
+                previous = d
+            if previous is not None:
+                yield previous
@@ -28,21 +28,24 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import math
 import os
+import tempfile
 
-from itertools import repeat
+from itertools import islice, repeat
 from typing import Dict, List, Tuple, TypeVar
 
 import torch
 
+from PIL import Image
 from torch import Tensor
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset, Subset
 from tqdm import tqdm
 
 from compressai_vision.evaluators import BaseEvaluator
 from compressai_vision.model_wrappers import BaseWrapper
 from compressai_vision.registry import register_pipeline
-from compressai_vision.utils import dl_to_ld, ld_to_dl, time_measure, to_cpu
+from compressai_vision.utils import time_measure
 from compressai_vision.utils.measure_complexity import (
     calc_complexity_nn_part1_dn53,
     calc_complexity_nn_part1_plyr,
@@ -82,23 +85,40 @@ class VideoSplitInference(BasePipeline):
         device: Dict,
     ):
         super().__init__(configs, device)
-        self._input_ftensor_buffer = []
+        self._feature_store = {}
+        self._num_stored_frames = 0
         self.datatype = configs["datatype"]
 
     def build_input_lists(self, dataloader: DataLoader) -> Tuple[List]:
+        """
+        Collects the ids, sizes and file names of all the frames. They are read from
+        the records of the dataset when it has them, so that the frames are only
+        loaded (and decoded) once, by the NN-part-1 loop.
+        """
+        records = getattr(dataloader.dataset, "dataset", None)
+        if not isinstance(records, list) or len(records) != len(dataloader):
+            records = [d[0] for d in dataloader]
+
         gt_inputs = []
         file_names = []
-        for _, d in enumerate(dataloader):
+        for record in records:
+            if "height" in record and "width" in record:
+                height, width = record["height"], record["width"]
+            else:
+                # only the header of the image is read
+                with Image.open(record["file_name"]) as img:
+                    width, height = img.size
+
             gt_inputs.append(
                 [
                     {
-                        "image_id": d[0]["image_id"],
-                        "height": d[0]["height"],
-                        "width": d[0]["width"],
+                        "image_id": record["image_id"],
+                        "height": height,
+                        "width": width,
                     },
                 ]
             )
-            file_names.append(d[0]["file_name"])
+            file_names.append(record["file_name"])
         return gt_inputs, file_names
 
     def __call__(
@@ -131,14 +151,12 @@ class VideoSplitInference(BasePipeline):
 
         if not self.configs["codec"]["decode_only"]:
             ## NN-part-1
-            for e, d in enumerate(tqdm(dataloader)):
+            frames = self._frame_range(
+                dataloader, self._codec_skip_n_frames, self._codec_end_frame_idx
+            )
+            for e, d in enumerate(tqdm(frames), start=self._codec_skip_n_frames):
                 output_file_prefix = f"img_id_{d[0]['image_id']}"
 
-                if e < self._codec_skip_n_frames:
-                    continue
-                if e >= self._codec_end_frame_idx:
-                    break
-
                 if self.is_mac_calculation and e == self._codec_skip_n_frames:
                     kmacs, pixels = vision_model.calc_complexity("nn_part_1", d)
                     self.add_kmac_and_pixels_info("nn_part_1", kmacs, pixels)
@@ -149,9 +167,7 @@ class VideoSplitInference(BasePipeline):
                 )
                 self.update_time_elapsed("nn_part_1", (time_measure() - start))
 
-                self._input_ftensor_buffer.append(
-                    {k: to_cpu(tensor) for k, tensor in res["data"].items()}
-                )
+                self._collect_input_data(res["data"], e - self._codec_skip_n_frames)
 
                 del res["data"]
 
@@ -172,7 +188,10 @@ class VideoSplitInference(BasePipeline):
 
                 del d[0]["image"]
 
-            assert len(self._input_ftensor_buffer) == self._codec_n_frames_to_be_encoded
+            assert self._num_stored_frames == self._codec_n_frames_to_be_encoded
+            if torch.cuda.is_available():
+                # wait for the asynchronous copies of the features
+                torch.cuda.synchronize()
 
             if self.configs["nn_task_part1"].generate_features_only is True:
                 print(
@@ -180,13 +199,11 @@ class VideoSplitInference(BasePipeline):
                 )
                 raise SystemExit(0)
 
-            # concatenate a list of tensors at each keyword item
-            features["data"] = self._feature_tensor_list_to_dict(
-                self._input_ftensor_buffer
-            )
+            # the tensors of all the frames at each keyword item
+            features["data"] = self._feature_store
 
             if not evaluator.calculate_feature_mse:
-                self._input_ftensor_buffer = []
+                self._feature_store = {}
 
             # datatype conversion
             features["data"] = {
@@ -261,85 +278,137 @@ class VideoSplitInference(BasePipeline):
                 vision_model, first_frame
             )
 
-        # separate a tensor of each keyword item into a list of tensors
-        dec_ftensors_list = self._feature_tensor_dict_to_list(dec_features["data"])
+        # a tensor of all the frames at each keyword item
+        dec_ftensors = self._stack_feature_tensors(dec_features["data"])
         assert all(
-            [self.datatype in str(d.dtype) for d in dec_ftensors_list[0].values()]
+            [self.datatype in str(v.dtype) for v in dec_ftensors.values()]
         ), "Output features not of expected datatype"
 
-        dec_ftensors_list = [
-            {k: v.type(torch.float32) for k, v in d.items()} for d in dec_ftensors_list
-        ]
+        dec_ftensors = {k: v.type(torch.float32) for k, v in dec_ftensors.items()}
 
-        assert len(dec_ftensors_list) == len(dataloader), (
-            f"The number of decoded frames ({len(dec_ftensors_list)}) is not equal "
+        num_dec_frames = len(next(iter(dec_ftensors.values())))
+        assert num_dec_frames == len(dataloader), (
+            f"The number of decoded frames ({num_dec_frames}) is not equal "
             f"to the number of frames supposed to be decoded ({len(dataloader)})"
         )
 
         self.logger.info("Processing NN-Part2...")
         output_list = []
 
-        if getattr(self, "vis_dir", None):
-            dec_ftensors_list = zip(dec_ftensors_list, dataloader)
-        else:
-            dec_ftensors_list = zip(dec_ftensors_list, repeat(None))
-
-        for e, (ftensors, d) in enumerate(
-            tqdm(dec_ftensors_list, total=len(dataloader))
-        ):
-            data = {k: v.to(self.device_nn_part2) for k, v in ftensors.items()}
-            dec_features["data"] = data
-            dec_features["file_name"] = file_names[e]
-            dec_features["file_origin"] = file_names[e]
-            dec_features["qp"] = (
-                "uncmp" if codec.qp_value is None else codec.qp_value
-            )  # Assuming one qp will be used
-
-            if self.is_mac_calculation and e == 0:
-                kmacs, pixels = vision_model.calc_complexity(
-                    "nn_part_2", dec_features, data
-                )
-                self.add_kmac_and_pixels_info("nn_part_2", kmacs, pixels)
-
-            start = time_measure()
-            pred = self._from_features_to_output(vision_model, dec_features)
-            self.update_time_elapsed("nn_part_2", (time_measure() - start))
-
-            if evaluator:
-                mse_enabled = (
-                    evaluator.calculate_feature_mse
-                    and not self.configs["codec"]["decode_only"]
-                )
-                mse_results = (
-                    self.calc_feature_mse(self._input_ftensor_buffer[e], data)
-                    if mse_enabled
-                    else None
-                )
-
-                evaluator.digest(gt_inputs[e], pred, mse_results)  # digest handles None
-
-                if getattr(self, "vis_dir", None) and hasattr(
-                    evaluator, "save_visualization"
-                ):
-                    evaluator.save_visualization(
-                        d, pred, self.vis_dir, self.vis_threshold
-                    )
-            out_res = dec_features.copy()
-            del (out_res["data"], out_res["org_input_size"])
-
-            if not isinstance(res["bitstream"], dict):
-                out_res["bytes"] = os.stat(res["bitstream"]).st_size / len(dataloader)
-            else:
-                assert len(res["bytes"]) == len(dataloader)
-                out_res["bytes"] = res["bytes"][e]
+        batch_size = self._get_nn_part2_batch_size(vision_model)
+        input_size = dec_features["input_size"]
 
-            out_res["coded_order"] = e
-            out_res["input_size"] = dec_features["input_size"][0]
-            out_res["org_input_size"] = (
-                f"{dec_features['org_input_size']['height']}x{dec_features['org_input_size']['width']}"
+        dec_frames = self._iterate_frames(
+            dec_ftensors, self.device_nn_part2, batch_size
+        )
+        if getattr(self, "vis_dir", None):  # one frame at a time
+            dec_frames = zip(dec_frames, dataloader)
+        else:
+            dec_frames = zip(dec_frames, repeat(None))
+
+        dec_features["file_name"] = file_names[0]
+        dec_features["file_origin"] = file_names[0]
+        dec_features["qp"] = (
+            "uncmp" if codec.qp_value is None else codec.qp_value
+        )  # Assuming one qp will be used
+
+        # the entries of the output results that are the same for all the frames
+        frame_info = {
+            k: v for k, v in dec_features.items() if k not in ("data", "org_input_size")
+        }
+        frame_info["input_size"] = input_size[0]
+        org_input_size = f"{dec_features['org_input_size']['height']}x{dec_features['org_input_size']['width']}"
+
+        # resolved once for all the frames
+        if not isinstance(res["bitstream"], dict):
+            frame_bytes = [os.stat(res["bitstream"]).st_size / len(dataloader)] * len(
+                dataloader
             )
+        else:
+            assert len(res["bytes"]) == len(dataloader)
+            frame_bytes = res["bytes"]
+        mse_enabled = bool(
+            evaluator
+            and evaluator.calculate_feature_mse
+            and not self.configs["codec"]["decode_only"]
+        )
+        save_visualization = bool(
+            evaluator
+            and getattr(self, "vis_dir", None)
+            and hasattr(evaluator, "save_visualization")
+        )
+        is_mac_calculation = self.is_mac_calculation
+
+        # nothing computed in nn part 2 is used with autograd or modified later
+        with torch.inference_mode():
+            e = 0
+            for batch, d in tqdm(
+                dec_frames, total=math.ceil(len(dataloader) / batch_size)
+            ):
+                dec_features["data"] = batch
+                dec_features["file_name"] = file_names[e]
+                dec_features["file_origin"] = file_names[e]
+
+                if is_mac_calculation and e == 0:
+                    kmacs, pixels = vision_model.calc_complexity(
+                        "nn_part_2", dec_features, batch
+                    )
+                    self.add_kmac_and_pixels_info("nn_part_2", kmacs, pixels)
+
+                if batch_size == 1:
+                    frame_batch = [batch]
+                else:
+                    # the frames of a batch all have the same input size
+                    frame_batch = [
+                        {k: v[i : i + 1] for k, v in batch.items()}
+                        for i in range(len(next(iter(batch.values()))))
+                    ]
+                    dec_features["input_size"] = input_size * len(frame_batch)
 
-            output_list.append(out_res)
+                start = time_measure()
+                preds = self._from_features_to_output(vision_model, dec_features)
+                self.update_time_elapsed("nn_part_2", (time_measure() - start))
+
+                # one result per frame
+                if batch_size == 1:
+                    preds = [preds]
+                else:
+                    preds = [[pred] for pred in preds]
+                    dec_features["input_size"] = input_size
+
+                for data, pred in zip(frame_batch, preds):
+                    if evaluator:
+                        mse_results = (
+                            self.calc_feature_mse(
+                                {
+                                    k: v[e : e + 1]
+                                    for k, v in self._feature_store.items()
+                                },
+                                data,
+                            )
+                            if mse_enabled
+                            else None
+                        )
+
+                        evaluator.digest(
+                            gt_inputs[e], pred, mse_results
+                        )  # digest handles None
+
+                        if save_visualization:
+                            evaluator.save_visualization(
+                                d, pred, self.vis_dir, self.vis_threshold
+                            )
+                    output_list.append(
+                        {
+                            **frame_info,
+                            "file_name": file_names[e],
+                            "file_origin": file_names[e],
+                            "bytes": frame_bytes[e],
+                            "coded_order": e,
+                            "org_input_size": org_input_size,
+                        }
+                    )
+                    e += 1
 
         # Calculate mac considering number of coded feature frames
         if self.is_mac_calculation:
@@ -357,25 +426,181 @@ class VideoSplitInference(BasePipeline):
             self.complexity_calc_by_module,
         )
 
+    def _collect_input_data(self, data: Dict[str, Tensor], idx: int):
+        """
+        Copies the features of the idx-th frame to be encoded into tensors of all the
+        frames, allocated with the first frame. Features on a gpu are copied
+        asynchronously to pinned memory, overlapping the next frames' nn part 1.
+        """
+        if idx == 0:
+            pin_memory = any(tensor.is_cuda for tensor in data.values())
+            store_dir = self.configs["nn_task_part1"].get("feature_store_dir", None)
+            self._feature_store = {
+                k: self._allocate_feature_store(
+                    (self._codec_n_frames_to_be_encoded, *tensor.shape[1:]),
+                    tensor.dtype,
+                    pin_memory,
+                    store_dir,
+                )
+                for k, tensor in data.items()
+            }
+
+        dst = [self._feature_store[k][idx : idx + 1] for k in data]
+        src = [tensor.detach() for tensor in data.values()]
+        if hasattr(torch, "_foreach_copy_"):  # torch >= 2.1, a single dispatch
+            torch._foreach_copy_(dst, src, non_blocking=True)
+        else:
+            for out, tensor in zip(dst, src):
+                out.copy_(tensor, non_blocking=True)
+        self._num_stored_frames = idx + 1
+
     @staticmethod
-    def _feature_tensor_list_to_dict(
-        data: List[Dict[str, Tensor]],
-    ) -> Dict[str, Tensor]:
+    def _allocate_feature_store(
+        shape: Tuple[int], dtype: torch.dtype, pin_memory: bool, store_dir=None
+    ) -> Tensor:
         """
-        Converts a list of feature tensors into a dictionary format.
+        Allocates the tensor of the features of all the frames, in host memory or
+        mapped to a file in store_dir, whose pages the OS writes back to disk and
+        evicts when memory runs low.
         """
-        return {k: torch.cat(ftensors) for k, ftensors in ld_to_dl(data).items()}
+        if store_dir is None:
+            return torch.empty(shape, dtype=dtype, pin_memory=pin_memory)
+
+        os.makedirs(store_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=store_dir, delete=False) as f:
+            path = f.name
+        try:
+            store = torch.from_file(
+                path, shared=True, size=math.prod(shape), dtype=dtype
+            )
+        finally:
+            # the mapping stays valid, and the file is released with the tensor
+            os.remove(path)
+        return store.view(shape)
 
     @staticmethod
-    def _feature_tensor_dict_to_list(data: Dict):
+    def _stack_feature_tensors(data: Dict) -> Dict[str, Tensor]:
         """
-        Converts a dict of feature tensors into a list of tensors.
+        Converts a dict of feature tensors, or of lists of per-frame tensors,
+        into a dict of tensors of all the frames.
         """
 
-        def coerce_tensors(vs) -> List[Tensor]:
+        def coerce_tensors(vs) -> Tensor:
             assert isinstance(vs, Tensor) or (
                 isinstance(vs, list) and all(isinstance(v, Tensor) for v in vs)
             )
-            return list(vs)
+            if isinstance(vs, Tensor):
+                return vs
+
+            # stacked in a single write into the destination, pinned to be
+            # uploaded frame by frame to the gpu
+            out = torch.empty(
+                (len(vs),) + vs[0].shape,
+                dtype=vs[0].dtype,
+                device=vs[0].device,
+                pin_memory=torch.cuda.is_available() and vs[0].device.type == "cpu",
+            )
+            torch.stack(vs, out=out)
+            vs.clear()
+            return out
+
+        return {k: coerce_tensors(tensors) for k, tensors in data.items()}
+
+    @staticmethod
+    def _frame_range(dataloader: DataLoader, start: int, end: int):
+        """
+        Returns an iterable over the frames [start, end) of the dataloader, which
+        does not load the frames outside of the range.
+        """
+        end = min(end, len(dataloader))
+        if start == 0 and end == len(dataloader):
+            return dataloader
+
+        if dataloader.batch_size != 1 or isinstance(
+            dataloader.dataset, IterableDataset
+        ):
+            return islice(dataloader, start, end)
+
+        return DataLoader(
+            Subset(dataloader.dataset, range(start, end)),
+            batch_size=1,
+            num_workers=dataloader.num_workers,
+            collate_fn=dataloader.collate_fn,
+            pin_memory=dataloader.pin_memory,
+            prefetch_factor=dataloader.prefetch_factor,
+            persistent_workers=dataloader.persistent_workers,
+        )
+
+    def _get_nn_part2_batch_size(self, vision_model: BaseWrapper) -> int:
+        """
+        Returns the number of frames processed at once by nn part 2, which is 1
+        when the vision model or the per-frame outputs require it.
+        """
+        batch_size = max(int(self.configs["nn_task_part2"].get("batch_size", 1)), 1)
+        if batch_size == 1:
+            return 1
+
+        per_frame_outputs = (
+            self.configs["nn_task_part2"].dump_results
+            or self.configs["nn_task_part2"].dump_features
+            or self.configs["nn_task_part2"].dump_features_hash
+            or self.configs["conformance"].save_conformance_files
+            or getattr(self, "vis_dir", None)
+            or self.is_mac_calculation
+        )
+        if per_frame_outputs or not vision_model.supports_batched_features:
+            self.logger.warning(
+                "nn part 2 is run one frame at a time for this vision model and configuration"
+            )
+            return 1
+
+        return batch_size
+
+    @staticmethod
+    def _iterate_frames(ftensors: Dict[str, Tensor], device, batch_size: int = 1):
+        """
+        Yields the features of each frame on device, or of each batch of frames
+        with batch_size > 1. On a gpu, host features are copied from pinned memory
+        on a separate stream, the next frame while the current one is processed.
+        """
+        num_frames = len(next(iter(ftensors.values())))
+        # frames or batches of frames
+        slices = range(num_frames)
+        if batch_size > 1:
+            slices = [
+                slice(e, min(e + batch_size, num_frames))
+                for e in range(0, num_frames, batch_size)
+            ]
 
-        return dl_to_ld({k: coerce_tensors(tensors) for k, tensors in data.items()})
+        device = torch.device(device)
+        if device.type != "cuda":
+            for e in slices:
+                yield {k: v[e].to(device) for k, v in ftensors.items()}
+            return
+
+        upload_stream = torch.cuda.Stream(device)
+
+        def pinned(x: Tensor) -> Tensor:
+            # only the slice is pinned, if it is on the host and not pinned yet
+            if x.device.type != "cpu" or x.is_pinned():
+                return x
+            return x.pin_memory()
+
+        def upload(e):
+            with torch.cuda.stream(upload_stream):
+                return {
+                    k: pinned(v[e]).to(device, non_blocking=True)
+                    for k, v in ftensors.items()
+                }
+
+        next_frame = upload(slices[0]) if len(slices) > 0 else None
+        for i in range(len(slices)):
+            frame = next_frame
+            compute_stream = torch.cuda.current_stream(device)
+            compute_stream.wait_stream(upload_stream)
+            for tensor in frame.values():
+                # allocated on the upload stream, used on the compute stream
+                tensor.record_stream(compute_stream)
+            if i + 1 < len(slices):
+                next_frame = upload(slices[i + 1])
+            yield frame
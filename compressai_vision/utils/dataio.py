@@ -28,10 +28,12 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import enum
+import io
 import logging
+import os
 
 from pathlib import Path
-from typing import Tuple
+from typing import Union
 
 import numpy as np
 import torch
@@ -65,6 +67,23 @@ bitdepth_to_dtype = {
     16: np.uint16,
 }
 
+# smallest signed torch integer dtypes holding the samples (torch 2.0 has no uint16),
+# to cast frames before copying them from an accelerator to the host
+bitdepth_to_torch_dtype = {
+    8: torch.uint8,
+    10: torch.int16,
+    12: torch.int16,
+    14: torch.int16,
+    16: torch.int32,
+}
+
+# max. number of buffers of a scatter-gather write
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+# small writes (e.g., planes of small frames) are combined up to this size,
+# larger ones (e.g., all the frames at once) go straight to the file
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
 bitdepth_to_mid_level = {
     8: 128,
     10: 512,
@@ -74,6 +93,35 @@ bitdepth_to_mid_level = {
 }
 
 
+def advise_file_access(file, advice: str) -> None:
+    """
+    hints the kernel about the upcoming accesses to a whole file (path or file object),
+    no-op where posix_fadvise is not available.
+
+    advice: "sequential" (read once, from start to end, more readahead)
+            or "dontneed" (the cached pages of the file can be dropped)
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    flags = {
+        "sequential": [os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_WILLNEED],
+        "dontneed": [os.POSIX_FADV_DONTNEED],
+    }[advice]
+
+    if isinstance(file, io.IOBase):
+        for flag in flags:
+            os.posix_fadvise(file.fileno(), 0, 0, flag)
+        return
+
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        for flag in flags:
+            os.posix_fadvise(fd, 0, 0, flag)
+    finally:
+        os.close(fd)
+
+
 class readwriteYUV:
     """ " """
 
@@ -86,6 +134,10 @@ class readwriteYUV:
         self._align = align
         self._surround = surround
         self._logger = logging.getLogger(self.__class__.__name__)
+        self.reader = None
+        self._read_path = None
+        self.writer = None
+        self._write_fd = None
 
     @property
     def device(self):
@@ -165,7 +217,7 @@ class readwriteYUV:
 
     def setReader(
         self,
-        read_path: str,
+        read_path: Union[str, io.IOBase],
         frmWidth,
         frmHeight,
         format=None,
@@ -178,7 +230,8 @@ class readwriteYUV:
         align = self._align if align is None else align
         surround = self._surround if surround is None else surround
 
-        self._path_check(read_path)
+        if not isinstance(read_path, io.IOBase):
+            self._path_check(read_path)
         _frmWidth, _frmHeight = self._compute_new_frame_resolution(
             frmWidth, frmHeight, align
         )
@@ -188,14 +241,19 @@ class readwriteYUV:
         self._gap_in_width = _frmWidth - frmWidth
         self._gap_in_height = _frmHeight - frmHeight
 
-        self.reader = yuvio.get_reader(
-            read_path, _frmWidth, _frmHeight, format.value[0]
-        )
+        # the yuvio reader is only opened by read_one_frame,
+        # read_multiple_frames maps the file directly, or reads the stream
+        # (e.g., the output pipe of a decoder) sequentially
+        self.reader = None
         self.pixel_bitdepth = format.value[1]
 
+        self._read_path = read_path
+        self._read_format = format
+        self._read_size = (_frmHeight, _frmWidth)
+
     def setWriter(
         self,
-        write_path: str,
+        write_path: Union[str, io.IOBase],
         frmWidth,
         frmHeight,
         format=None,
@@ -208,13 +266,41 @@ class readwriteYUV:
         align = self._align if align is None else align
         surround = self._surround if surround is None else surround
 
-        self._path_create(write_path)
         frmWidth, frmHeight = self._compute_new_frame_resolution(
             frmWidth, frmHeight, align
         )
-        self.writer = yuvio.get_writer(write_path, frmWidth, frmHeight, format.value[0])
+        self.closeWriter()
+        # the file handle is kept so that frames can also be written in bulk
+        if isinstance(write_path, io.IOBase):
+            # e.g., a pipe to the standard input of an encoder
+            self._write_fd = write_path
+        else:
+            self._path_create(write_path)
+            self._write_fd = open(write_path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.writer = yuvio.get_writer(
+            self._write_fd, frmWidth, frmHeight, format.value[0]
+        )
         self.pixel_bitdepth = format.value[1]
 
+        # flat chroma plane, allocated once and shared by all the written frames
+        chHeight, chWidth = self._chroma_plane_size(format, frmHeight, frmWidth)
+        self._chroma_plane = None
+        if chHeight > 0:
+            self._chroma_plane = np.full(
+                (chHeight, chWidth),
+                bitdepth_to_mid_level[self.pixel_bitdepth],
+                dtype=np.dtype(bitdepth_to_dtype[self.pixel_bitdepth]).newbyteorder(
+                    "<"
+                ),
+            )
+
+    def closeWriter(self):
+        """flushes and closes the file written by the writer"""
+        if self._write_fd is not None:
+            self._write_fd.close()
+        self._write_fd = None
+        self.writer = None
+
     def write_one_frame(self, frame: Tensor, mid_level=None, frame_idx: int = 0):
         """sets up and write a yuv frame, including padding and adding flat chroma components when needed"""
         if self.writer is None:
@@ -256,37 +342,109 @@ class readwriteYUV:
 
         frame = self.pad(frame, self._align, mid_level, surround=self._surround)
 
-        y_channel = np.array(frame[0].numpy(force=True), dtype=dtype)
+        # planes are written as raw little-endian rasters
+        y_channel = np.asarray(
+            frame[0].numpy(force=True), dtype=np.dtype(dtype).newbyteorder("<")
+        )
         if self.format == PixelFormat.YUV400 or self.format == PixelFormat.YUV400_10le:
-            frame = yuvio.frame((y_channel, None, None), self._format.value[0])
+            self._write_fd.write(y_channel.data)
         elif (
             self.format == PixelFormat.YUV444 or self.format == PixelFormat.YUV444_10le
         ):
-            u_channel = (
-                np.ones((frame.shape[1], frame.shape[2]), dtype=dtype)
-                * bitdepth_to_mid_level[self.pixel_bitdepth]
-            )
-            v_channel = (
-                np.ones((frame.shape[1], frame.shape[2]), dtype=dtype)
-                * bitdepth_to_mid_level[self.pixel_bitdepth]
-            )
-            frame = yuvio.frame(
-                (y_channel, u_channel, v_channel), self._format.value[0]
-            )
+            self._write_planes([y_channel, self._chroma_plane, self._chroma_plane])
         else:
             # TODO do it with 420 too in case we want to use less mem? Whatch for even sizes and padding
             raise NotImplementedError
 
-        self.writer.write(frame)
+    def _write_planes(self, planes):
+        """writes contiguous planes in order with scatter-gather writes,
+        without first joining them in a single buffer"""
+        if not hasattr(os, "writev"):
+            for plane in planes:
+                self._write_fd.write(plane.data)
+            return
+
+        self._write_fd.flush()  # keep the order with previously buffered writes
+        fd = self._write_fd.fileno()
+
+        views = [memoryview(plane).cast("B") for plane in planes]
+        idx = 0
+        while idx < len(views):
+            num_written = os.writev(fd, views[idx : idx + IOV_MAX])
+            # skip what was written, possibly only part of a plane
+            while num_written > 0:
+                if num_written >= len(views[idx]):
+                    num_written -= len(views[idx])
+                    idx += 1
+                else:
+                    views[idx] = views[idx][num_written:]
+                    num_written = 0
 
-    def write_multiple_frames(self, frames: Tensor, alignment=2):
-        raise NotImplementedError
+    @staticmethod
+    def _chroma_plane_size(format: PixelFormat, frmHeight, frmWidth):
+        """size (height, width) of each chroma plane, (0, 0) for 4:0:0"""
+        pix_fmt = format.value[0]
+        if pix_fmt.startswith("gray"):
+            return 0, 0
+        if pix_fmt.startswith("yuv420"):
+            return (frmHeight + 1) // 2, (frmWidth + 1) // 2
+        if pix_fmt.startswith("yuv422"):
+            return frmHeight, (frmWidth + 1) // 2
+        return frmHeight, frmWidth
+
+    def write_multiple_frames(self, frames: Tensor, mid_level=None):
+        """pads and writes a stack of single plane frames (N, H, W) with a single write,
+        adding flat chroma components when needed"""
+        if self.writer is None:
+            raise RuntimeError("Please first setup the writer")
+
+        assert (
+            frames.dim() == 3
+        ), "Input shall be a stack of single plane frames with dimension of (N, H, W)"
+
+        if mid_level is None:
+            mid_level = bitdepth_to_mid_level[self.pixel_bitdepth]
+
+        if frames.device.type != "cpu":
+            # quantized on the device, only the integer samples are copied to the host
+            frames = frames.to(bitdepth_to_torch_dtype[self.pixel_bitdepth])
+
+        frames = self.pad(frames, self._align, mid_level, surround=self._surround)
+        nb_frames, frmHeight, frmWidth = frames.shape
+
+        # planar frames are just consecutive little-endian rasters, Y then U and V
+        dtype = np.dtype(bitdepth_to_dtype[self.pixel_bitdepth]).newbyteorder("<")
+        luma = np.asarray(frames.numpy(force=True), dtype=dtype)
+
+        chHeight, chWidth = self._chroma_plane_size(self.format, frmHeight, frmWidth)
+        if chHeight == 0:
+            self._write_fd.write(luma.data)
+            return
+
+        self._logger.warning(
+            "Input contains one plane and will be extended with flat chroma components"
+        )
+        chroma = self._chroma_plane
+        if chroma is None or chroma.shape != (chHeight, chWidth):
+            chroma = np.full(
+                (chHeight, chWidth), bitdepth_to_mid_level[self.pixel_bitdepth], dtype
+            )
+        # the same flat chroma plane is referenced for all the frames
+        self._write_planes([plane for y in luma for plane in (y, chroma, chroma)])
 
     def read_one_frame(self, frm_idx=0):
         """
         arguments:
 
         """
+        if self.reader is None:
+            if self._read_path is None:
+                raise RuntimeError("Please first setup the reader")
+            frmHeight, frmWidth = self._read_size
+            self.reader = yuvio.get_reader(
+                self._read_path, frmWidth, frmHeight, self._read_format.value[0]
+            )
+
         frame = self.reader.read(index=frm_idx, count=1)[0]
         y, u, v = frame.split()
 
@@ -295,8 +453,69 @@ class readwriteYUV:
         out = self.crop(out, (self._gap_in_width, self._gap_in_height), self._surround)
         return out
 
-    def read_multiple_frames(self, crop: Tuple):
-        raise NotImplementedError
+    def read_multiple_frames(self, num_frames: int = -1):
+        """reads the luma plane of num_frames (all if -1) frames with one read, returned as a (N, H, W) tensor"""
+        if self._read_path is None:
+            raise RuntimeError("Please first setup the reader")
+
+        frmHeight, frmWidth = self._read_size
+        chHeight, chWidth = self._chroma_plane_size(
+            self._read_format, frmHeight, frmWidth
+        )
+        luma_size = frmHeight * frmWidth
+        frame_size = luma_size + 2 * chHeight * chWidth
+
+        dtype = np.dtype(bitdepth_to_dtype[self.pixel_bitdepth]).newbyteorder("<")
+        if isinstance(self._read_path, io.IOBase):
+            assert (
+                num_frames >= 0
+            ), "the number of frames to read from a stream is required"
+            frames = self._read_frames_from_stream(
+                self._read_path, num_frames, dtype, frame_size, luma_size
+            )
+            out = torch.from_numpy(frames).to(self._device)
+            return self.crop(
+                out, (self._gap_in_width, self._gap_in_height), self._surround
+            )
+
+        # the samples are converted straight from the page cache,
+        # without an intermediate copy of the whole file
+        with open(self._read_path, "rb") as f:
+            if num_frames < 0:
+                # all the complete frames of the opened file
+                num_frames = os.fstat(f.fileno()).st_size // (
+                    frame_size * dtype.itemsize
+                )
+
+            # the mapping shares the readahead state of f
+            advise_file_access(f, "sequential")
+            frames = np.memmap(f, dtype=dtype, mode="r", shape=(num_frames, frame_size))
+            frames = frames[:, :luma_size].reshape(num_frames, frmHeight, frmWidth)
+
+            out = torch.from_numpy(frames.astype("float32")).to(self._device)
+            del frames
+        out = self.crop(out, (self._gap_in_width, self._gap_in_height), self._surround)
+        return out
+
+    def _read_frames_from_stream(
+        self, stream, num_frames: int, dtype, frame_size: int, luma_size: int
+    ) -> np.ndarray:
+        """reads the frames one by one, each converted as soon as it is available"""
+        frmHeight, frmWidth = self._read_size
+        frames = np.empty((num_frames, frmHeight, frmWidth), dtype=np.float32)
+
+        buffer = np.empty(frame_size, dtype=dtype)
+        view = memoryview(buffer).cast("B")
+        for frame in frames:
+            num_read = 0
+            while num_read < len(view):
+                n = stream.readinto(view[num_read:])
+                if not n:
+                    raise EOFError(f"stream ended after {num_read} bytes of a frame")
+                num_read += n
+            frame[...] = buffer[:luma_size].reshape(frmHeight, frmWidth)
+
+        return frames
 
 
 def read_image_to_rgb_tensor(filepath: Path) -> torch.Tensor:
@@ -30,12 +30,13 @@
 import concurrent.futures as cf
 import multiprocessing
 import os
+import queue
 import resource
 import subprocess
 import sys
 
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import IO, Any, Callable, List, Optional
 
 
 def get_max_num_cpus():
@@ -55,14 +56,52 @@ def prevent_core_dump():
     resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
 
 
-def run_cmdlines_parallel(cmds: List[Any], logpath: Optional[Path] = None) -> None:
+def _get_core_sets(num_sets: int, cores_per_set: int) -> queue.Queue:
+    """splits the available cpus into num_sets disjoint sets of cores_per_set cpus"""
+    cpus = sorted(os.sched_getaffinity(0))
+    num_cores = num_sets * cores_per_set
+    assert num_cores <= len(cpus), f"{num_cores} cores requested, {len(cpus)} cpus"
+    core_sets = queue.Queue()
+    for i in range(num_sets):
+        core_sets.put(cpus[i * cores_per_set : (i + 1) * cores_per_set])
+    return core_sets
+
+
+def run_cmdlines_parallel(
+    cmds: List[Any],
+    logpath: Optional[Path] = None,
+    max_workers: Optional[int] = None,
+    cores_per_worker: Optional[int] = None,
+) -> None:
+    """runs the command lines in order, at most max_workers (default: number
+    of available cpus) at once, each started as soon as a previous one ends.
+    With cores_per_worker, each running command is pinned to its own set of
+    cpus and niced, so that it keeps its caches and the caller stays responsive;
+    max_workers is then capped at the number of such sets the cpus allow"""
+
     def worker(cmd, id, logpath):
         print(f"--> job_id [{id:03d}] Running: {' '.join(cmd)}", file=sys.stdout)
+        if core_sets is None:
+            return run_worker(cmd, id, logpath, prevent_core_dump)
+
+        cores = core_sets.get()
+        try:
+
+            def pin_to_cores():
+                prevent_core_dump()
+                os.sched_setaffinity(0, cores)
+                os.nice(5)
+
+            run_worker(cmd, id, logpath, pin_to_cores)
+        finally:
+            core_sets.put(cores)
+
+    def run_worker(cmd, id, logpath, preexec_fn):
         p = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            preexec_fn=prevent_core_dump,
+            preexec_fn=preexec_fn,
         )
 
         if logpath is not None:
@@ -76,11 +115,23 @@ def run_cmdlines_parallel(cmds: List[Any], logpath: Optional[Path] = None) -> No
         else:
             p.stdout.read()  # clear up
 
-    with cf.ThreadPoolExecutor(get_max_num_cpus()) as exec:
+    if max_workers is None:
+        max_workers = get_max_num_cpus()
+
+    core_sets = None
+    if cores_per_worker and hasattr(os, "sched_setaffinity"):
+        # one set per running command, handed over to the next command when it ends
+        num_cpus = get_max_num_cpus()
+        cores_per_worker = min(cores_per_worker, num_cpus)
+        max_workers = min(max_workers, num_cpus // cores_per_worker)
+        core_sets = _get_core_sets(max_workers, cores_per_worker)
+
+    with cf.ThreadPoolExecutor(max_workers) as exec:
         all_jobs = [
             exec.submit(worker, cmd, id, logpath) for id, cmd in enumerate(cmds)
         ]
-        cf.wait(all_jobs)
+        for job in cf.as_completed(all_jobs):
+            job.result()  # re-raise a failed job
 
     return
 
@@ -101,3 +152,92 @@ def run_cmdline(cmdline: List[Any], logpath: Optional[Path] = None) -> None:
                 line = bline.decode()
                 f.write(line)
     p.wait()
+
+
+def run_cmdline_with_input(
+    cmdline: List[Any],
+    write_input: Callable[[IO[bytes]], None],
+    logpath: Optional[Path] = None,
+) -> None:
+    """runs a command line while write_input(stdin) feeds its standard input"""
+    print(f"--> Running: {' '.join(cmdline)}", file=sys.stdout)
+
+    logfile = subprocess.DEVNULL if logpath is None else logpath.open("w")
+    try:
+        p = subprocess.Popen(
+            cmdline, stdin=subprocess.PIPE, stdout=logfile, stderr=subprocess.STDOUT
+        )
+        try:
+            with p.stdin:
+                write_input(p.stdin)
+        except BrokenPipeError:
+            # the command stopped reading its input, its exit code tells why
+            assert p.wait() == 0, f"{cmdline[0]} exited with code {p.returncode}"
+            raise
+        except BaseException:
+            p.kill()
+            p.wait()
+            raise
+        assert p.wait() == 0, f"{cmdline[0]} exited with code {p.returncode}"
+    finally:
+        if logpath is not None:
+            logfile.close()
+
+
+def run_cmdline_to_output(cmdline: List[Any], output: IO[bytes]) -> None:
+    """runs a command line writing its standard output directly to output,
+    e.g., the standard input of another process"""
+    print(f"--> Running: {' '.join(cmdline)}", file=sys.stdout)
+    subprocess.run(cmdline, stdout=output, check=True)
+
+
+def run_cmdline_with_output(
+    get_cmdline: Callable[[str], List[Any]],
+    read_output: Callable[[IO[bytes]], Any],
+    logpath: Optional[Path] = None,
+) -> Any:
+    """
+    runs the command line get_cmdline(output_path), where output_path is a pipe
+    that read_output(output) consumes while the command runs.
+    Returns what read_output returns.
+    """
+    read_fd, write_fd = os.pipe()
+    cmdline = get_cmdline(f"/dev/fd/{write_fd}")
+    print(f"--> Running: {' '.join(cmdline)}", file=sys.stdout)
+
+    logfile = subprocess.DEVNULL if logpath is None else logpath.open("w")
+    try:
+        # closing the pipe stops a command whose output is not read entirely
+        with open(read_fd, "rb") as output:
+            try:
+                p = subprocess.Popen(
+                    cmdline,
+                    stdout=logfile,
+                    stderr=subprocess.STDOUT,
+                    pass_fds=(write_fd,),
+                )
+            finally:
+                # only the child writes to the pipe, so that the reader sees its end
+                os.close(write_fd)
+            try:
+                result = read_output(output)
+            except BaseException as err:
+                killed = False
+                try:
+                    p.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+                    p.wait()
+                    killed = True
+                # the reader usually fails on the short output of a failed command
+                if not killed and p.returncode != 0:
+                    raise AssertionError(
+                        f"{cmdline[0]} exited with code {p.returncode}"
+                    ) from err
+                raise
+        assert p.wait() == 0, f"{cmdline[0]} exited with code {p.returncode}"
+    finally:
+        if logpath is not None:
+            logfile.close()
+
+    return result
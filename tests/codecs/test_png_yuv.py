@@ -0,0 +1,81 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+from compressai_vision.codecs.encdec_utils.png_yuv import PngFilesToYuvFileConverter
+
+
+def _make_converter(chroma_format, bitdepth=8):
+    return PngFilesToYuvFileConverter(
+        chroma_format,
+        bitdepth,
+        use_yuv=False,
+        frame_rate=1,
+        ffmpeg_loglevel="error",
+        logger=logging.getLogger(__name__),
+        backend="torch",
+    )
+
+
+@pytest.mark.parametrize("bitdepth", [8, 10])
+@pytest.mark.parametrize(
+    "chroma_format, chroma_size",
+    [("400", 0), ("420", 2 * 32 * 48), ("444", 2 * 63 * 95)],
+)
+def test_torch_conversion_output_size(tmp_path, chroma_format, chroma_size, bitdepth):
+    rng = np.random.default_rng(0)
+    image_files = []
+    for i in range(2):
+        image_file = tmp_path / f"{i}.png"
+        Image.fromarray(rng.integers(0, 256, (63, 95, 3), dtype=np.uint8)).save(
+            image_file
+        )
+        image_files.append(image_file)
+
+    converter = _make_converter(chroma_format, bitdepth)
+    assert converter.backend == "torch"
+
+    frame_height, frame_width = (64, 96) if chroma_format == "420" else (63, 95)
+    yuv_path = tmp_path / "out.yuv"
+    converter._convert_frames_torch(image_files, yuv_path, frame_width, frame_height)
+
+    luma_size = frame_width * frame_height
+    bytes_per_sample = 2 if bitdepth > 8 else 1
+    expected = len(image_files) * (luma_size + chroma_size) * bytes_per_sample
+    assert yuv_path.stat().st_size == expected
+
+
+def test_torch_conversion_falls_back_for_422():
+    assert _make_converter("422").backend == "ffmpeg"
@@ -0,0 +1,151 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mmap
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from compressai_vision.codecs.std_codecs import (
+    VTM,
+    HeaderReader,
+    HeaderWriter,
+    _distribute_parallel_work,
+)
+
+SEQUENCE_INFO = {"bitdepth": 10, "frame_size": (368, 640), "num_frames": 5}
+FRAME_INFO = {"minv": -17.8848, "maxv": 16.69418}
+
+
+def _read_value(value: float) -> float:
+    # stored as float32, read back rounded to 4 decimals
+    return float(f"{float(np.float32(value)):.4f}")
+
+
+@pytest.fixture
+def bitstream_path(tmp_path):
+    path = tmp_path / "header.bin"
+    writer = HeaderWriter()
+    with open(path, "wb") as fw:
+        header_size = writer.write_sequence_info(fw, SEQUENCE_INFO)
+        header_size += writer.write_frame_infos(
+            fw, FRAME_INFO, SEQUENCE_INFO["num_frames"]
+        )
+        fw.write(b"inner codec bitstream")
+    assert header_size == 1 + 3 * 4 + SEQUENCE_INFO["num_frames"] * 2 * 4
+    return path
+
+
+def _check_header(reader, fd):
+    sequence_info = reader.read_sequence_info(fd)
+    assert sequence_info["bitdepth"] == SEQUENCE_INFO["bitdepth"]
+    assert tuple(sequence_info["frame_size"]) == SEQUENCE_INFO["frame_size"]
+    assert sequence_info["num_frames"] == SEQUENCE_INFO["num_frames"]
+
+    num_frames = sequence_info["num_frames"]
+    frame_infos = reader.read_frame_infos(fd, num_frames)
+    np.testing.assert_array_equal(frame_infos["frame_id"], np.arange(num_frames))
+    for key in ("minv", "maxv"):
+        np.testing.assert_array_equal(
+            frame_infos[key], np.full(num_frames, _read_value(FRAME_INFO[key]))
+        )
+    assert fd.read() == b"inner codec bitstream"
+
+
+def test_frame_infos_round_trip(bitstream_path):
+    with open(bitstream_path, "rb") as fr:
+        _check_header(HeaderReader(), fr)
+
+
+def test_frame_infos_round_trip_mmap(bitstream_path):
+    with open(bitstream_path, "rb") as fr:
+        with mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            _check_header(HeaderReader(), buf)
+
+
+def test_frame_infos_match_per_frame_format(bitstream_path, tmp_path):
+    # the bulk writer and reader keep the per-frame layout of the header
+    path = tmp_path / "header_per_frame.bin"
+    writer = HeaderWriter()
+    with open(path, "wb") as fw:
+        writer.write_sequence_info(fw, SEQUENCE_INFO)
+        for _ in range(SEQUENCE_INFO["num_frames"]):
+            writer.write_frame_info(fw, FRAME_INFO)
+        fw.write(b"inner codec bitstream")
+    assert path.read_bytes() == bitstream_path.read_bytes()
+
+    reader = HeaderReader()
+    with open(path, "rb") as fr:
+        reader.read_sequence_info(fr)
+        for frame_id in range(SEQUENCE_INFO["num_frames"]):
+            frame_info = reader.read_frame_info(fr)
+            assert frame_info["frame_id"] == frame_id
+            assert frame_info["minv"] == _read_value(FRAME_INFO["minv"])
+            assert frame_info["maxv"] == _read_value(FRAME_INFO["maxv"])
+
+
+@pytest.mark.parametrize(
+    "num_frames, intra_period, expected_offsets, expected_counts",
+    [
+        (1, 32, [0], [1]),
+        (33, 32, [0], [33]),
+        (34, 32, [0, 32], [33, 2]),
+        (65, 32, [0, 32], [33, 33]),
+        (66, 32, [0, 32, 64], [33, 33, 2]),
+    ],
+)
+def test_distribute_parallel_work(
+    num_frames, intra_period, expected_offsets, expected_counts
+):
+    offsets, counts = _distribute_parallel_work(num_frames, intra_period)
+    assert offsets == expected_offsets
+    assert counts == expected_counts
+
+
+def test_yuv_cache_path_depends_on_features(tmp_path):
+    codec = SimpleNamespace(min_max_dataset=[-1.0, 1.0], yuv_cache_dir=tmp_path)
+    yuv_path = "out/seq_qp32_64x32_30fps_10bit_p400_input.yuv"
+    yuv_path_qp37 = yuv_path.replace("qp32", "qp37")
+
+    torch.manual_seed(0)
+    frames = torch.randn(2, 32, 64)
+    path = VTM._get_yuv_cache_path(codec, yuv_path, "seq_qp32", frames)
+    assert path == VTM._get_yuv_cache_path(codec, yuv_path_qp37, "seq_qp37", frames)
+    assert path.startswith(f"{tmp_path}/seq_64x32_30fps_10bit_p400_input_")
+    assert path.endswith(".yuv")
+
+    other_frames = frames.clone()
+    other_frames[0, 0, 0] += 1
+    assert path != VTM._get_yuv_cache_path(codec, yuv_path, "seq_qp32", other_frames)
+
+    codec.min_max_dataset = [-2.0, 2.0]
+    assert path != VTM._get_yuv_cache_path(codec, yuv_path, "seq_qp32", frames)
@@ -0,0 +1,70 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+import torch
+
+from compressai_vision.codecs.utils import (
+    min_max_inv_normalization,
+    min_max_normalization,
+)
+
+
+@pytest.mark.parametrize("bitdepth", [8, 10])
+@pytest.mark.parametrize("minv, maxv", [(-17.8848, 16.69418), (20.2466, 28.3974)])
+def test_min_max_normalization_inplace(bitdepth, minv, maxv):
+    torch.manual_seed(0)
+    x = torch.randn(4, 63, 95) * 20
+
+    expected, expected_mid_level = min_max_normalization(
+        x, minv, maxv, bitdepth=bitdepth
+    )
+    y = x.clone()
+    out, mid_level = min_max_normalization(
+        y, minv, maxv, bitdepth=bitdepth, inplace=True
+    )
+
+    assert out.data_ptr() == y.data_ptr()
+    assert torch.equal(out, expected)
+    assert mid_level == expected_mid_level
+
+
+@pytest.mark.parametrize("bitdepth", [8, 10])
+def test_min_max_inv_normalization_inplace(bitdepth):
+    torch.manual_seed(0)
+    x = torch.randint(0, 2**bitdepth, (4, 63, 95)).float()
+
+    expected = min_max_inv_normalization(x, -17.8848, 16.69418, bitdepth=bitdepth)
+    y = x.clone()
+    out = min_max_inv_normalization(
+        y, -17.8848, 16.69418, bitdepth=bitdepth, inplace=True
+    )
+
+    assert out.data_ptr() == y.data_ptr()
+    assert torch.equal(out, expected)
@@ -0,0 +1,172 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+
+from omegaconf import OmegaConf
+from torch.utils.data import DataLoader, Dataset
+
+from compressai_vision.pipelines.split_inference.video_split_inference import (
+    VideoSplitInference,
+)
+
+NUM_FRAMES = 6
+INPUT_SIZE = (32, 48)
+ORG_INPUT_SIZE = {"height": 60, "width": 90}
+
+
+class RecordDataset(Dataset):
+    """frames records, read by the pipeline without loading the frames"""
+
+    def __init__(self, num_frames):
+        self.dataset = [
+            {
+                "image_id": i,
+                "file_name": f"frame_{i:03d}.png",
+                **ORG_INPUT_SIZE,
+            }
+            for i in range(num_frames)
+        ]
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return self.dataset[idx]
+
+
+class BatchedRcnnStub:
+    """
+    Stands in for the detectron2 wrappers of nn part 2, which return one result
+    per frame of a batch of features, with the input size of each frame.
+    """
+
+    supports_batched_features = True
+    split_layer_list = ["p2", "p3"]
+
+    def features_to_output(self, x, device):
+        num_frames = len(x["data"]["p2"])
+        assert len(x["input_size"]) == num_frames
+        return [
+            {
+                "input_size": x["input_size"][i],
+                "org_input_size": x["org_input_size"],
+                "scores": torch.stack(
+                    [v[i].mean(dim=(1, 2)) for v in x["data"].values()]
+                ),
+            }
+            for i in range(num_frames)
+        ]
+
+
+def _make_pipeline(tmp_path, batch_size):
+    configs = OmegaConf.create(
+        {
+            "datatype": "float32",
+            "output_dir_root": str(tmp_path / "output"),
+            "codec": {
+                "bitstream_name": "seq",
+                "codec_output_dir": str(tmp_path / "codec"),
+                "measure_complexity": False,
+                "encode_only": False,
+                "decode_only": True,
+                "skip_n_frames": 0,
+                "n_frames_to_be_encoded": -1,
+            },
+            "visualization": {"save_visualization": False},
+            "nn_task_part1": {"load_features": False},
+            "nn_task_part2": {
+                "batch_size": batch_size,
+                "dump_results": False,
+                "dump_features": False,
+                "dump_features_hash": False,
+                "output_results_dir": str(tmp_path / "results"),
+            },
+            "conformance": {"save_conformance_files": False},
+            "evaluation": {"dump": False},
+        }
+    )
+    pipeline = VideoSplitInference(configs, {"nn_part1": "cpu", "nn_part2": "cpu"})
+    (tmp_path / "codec" / "seq.bin").write_bytes(bytes(NUM_FRAMES * 100))
+    return pipeline
+
+
+def _make_codec():
+    torch.manual_seed(0)
+    dec_features = {
+        "data": {
+            "p2": torch.randn(NUM_FRAMES, 4, 8, 12),
+            "p3": torch.randn(NUM_FRAMES, 4, 4, 6),
+        },
+        "org_input_size": dict(ORG_INPUT_SIZE),
+        "input_size": [INPUT_SIZE],
+    }
+    codec = MagicMock()
+    codec.qp_value = 32
+    codec.decode.return_value = (dec_features, {}, None)
+    return codec
+
+
+def _run(tmp_path, batch_size):
+    evaluator = MagicMock()
+    evaluator.calculate_feature_mse = False
+    dataloader = DataLoader(
+        RecordDataset(NUM_FRAMES), batch_size=1, collate_fn=lambda batch: batch
+    )
+
+    pipeline = _make_pipeline(tmp_path, batch_size)
+    _, _, output_list, _, _ = pipeline(
+        BatchedRcnnStub(), _make_codec(), dataloader, evaluator
+    )
+
+    digested = [call.args for call in evaluator.digest.call_args_list]
+    return output_list, digested
+
+
+@pytest.mark.parametrize("batch_size", [4, NUM_FRAMES])
+def test_batched_nn_part2_matches_frame_by_frame(tmp_path, batch_size):
+    output_list, digested = _run(tmp_path / "frame_by_frame", 1)
+    batched_output_list, batched_digested = _run(tmp_path / "batched", batch_size)
+
+    assert len(output_list) == NUM_FRAMES
+    assert batched_output_list == output_list
+
+    assert len(batched_digested) == len(digested) == NUM_FRAMES
+    for (gt, pred, mse), (batched_gt, batched_pred, batched_mse) in zip(
+        digested, batched_digested
+    ):
+        assert batched_gt == gt
+        assert batched_mse is mse is None
+        assert len(pred) == len(batched_pred) == 1
+        assert batched_pred[0]["input_size"] == pred[0]["input_size"] == INPUT_SIZE
+        assert batched_pred[0]["org_input_size"] == pred[0]["org_input_size"]
+        assert torch.equal(batched_pred[0]["scores"], pred[0]["scores"])
@@ -0,0 +1,83 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+import torch
+
+from compressai_vision.utils.dataio import PixelFormat, readwriteYUV
+
+# odd sizes, padded to the alignment when written
+NUM_FRAMES, HEIGHT, WIDTH = 3, 63, 95
+
+
+@pytest.fixture
+def frames():
+    torch.manual_seed(0)
+    return torch.randint(0, 2**10, (NUM_FRAMES, HEIGHT, WIDTH)).float()
+
+
+@pytest.mark.parametrize("format", [PixelFormat.YUV400_10le, PixelFormat.YUV444_10le])
+def test_write_multiple_frames_matches_write_one_frame(tmp_path, frames, format):
+    yuvio = readwriteYUV(device="cpu", format=format, align=2)
+
+    one_path = tmp_path / "one.yuv"
+    yuvio.setWriter(write_path=str(one_path), frmWidth=WIDTH, frmHeight=HEIGHT)
+    for idx, frame in enumerate(frames):
+        yuvio.write_one_frame(frame, mid_level=512, frame_idx=idx)
+    yuvio.closeWriter()
+
+    multiple_path = tmp_path / "multiple.yuv"
+    yuvio.setWriter(write_path=str(multiple_path), frmWidth=WIDTH, frmHeight=HEIGHT)
+    yuvio.write_multiple_frames(frames, mid_level=512)
+    yuvio.closeWriter()
+
+    assert multiple_path.read_bytes() == one_path.read_bytes()
+
+
+@pytest.mark.parametrize("format", [PixelFormat.YUV400_10le, PixelFormat.YUV444_10le])
+def test_read_multiple_frames_matches_read_one_frame(tmp_path, frames, format):
+    yuvio = readwriteYUV(device="cpu", format=format, align=2)
+
+    path = tmp_path / "frames.yuv"
+    yuvio.setWriter(write_path=str(path), frmWidth=WIDTH, frmHeight=HEIGHT)
+    yuvio.write_multiple_frames(frames, mid_level=512)
+    yuvio.closeWriter()
+
+    yuvio.setReader(read_path=str(path), frmWidth=WIDTH, frmHeight=HEIGHT)
+    read_frames = yuvio.read_multiple_frames()
+    assert read_frames.shape == (NUM_FRAMES, HEIGHT, WIDTH)
+    assert torch.equal(read_frames, frames)
+
+    for idx in range(NUM_FRAMES):
+        assert torch.equal(yuvio.read_one_frame(idx), read_frames[idx])
+
+    # also from a stream, e.g. the output pipe of a decoder
+    with open(path, "rb", buffering=0) as stream:
+        yuvio.setReader(read_path=stream, frmWidth=WIDTH, frmHeight=HEIGHT)
+        assert torch.equal(yuvio.read_multiple_frames(NUM_FRAMES), frames)
@@ -0,0 +1,90 @@
+# Copyright (c) 2022-2024, InterDigital Communications, Inc
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted (subject to the limitations in the disclaimer
+# below) provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of InterDigital Communications, Inc nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# NO EXPRESS OR IMPLIED LICENSES TO ANY PARTY'S PATENT RIGHTS ARE GRANTED BY
+# THIS LICENSE. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from compressai_vision.utils.external_exec import (
+    _get_core_sets,
+    run_cmdline_with_input,
+    run_cmdline_with_output,
+)
+
+
+@pytest.fixture
+def eight_cpus(monkeypatch):
+    monkeypatch.setattr(
+        "os.sched_getaffinity", lambda pid: {0, 1, 2, 3, 4, 5, 6, 7}, raising=False
+    )
+
+
+@pytest.mark.parametrize("cores_per_set", [1, 2, 3, 8])
+def test_core_sets_are_disjoint(eight_cpus, cores_per_set):
+    num_sets = 8 // cores_per_set
+    core_sets = _get_core_sets(num_sets, cores_per_set)
+
+    sets = [core_sets.get_nowait() for _ in range(num_sets)]
+    assert core_sets.empty()
+    assert all(len(cores) == cores_per_set for cores in sets)
+    all_cores = [core for cores in sets for core in cores]
+    assert len(set(all_cores)) == len(all_cores)
+
+
+def test_core_sets_reject_oversubscription(eight_cpus):
+    with pytest.raises(AssertionError):
+        _get_core_sets(3, 3)
+
+
+def test_cmdline_with_output_reports_command_failure():
+    def read_output(output):
+        data = output.read()
+        assert len(data) == 16, "short output"
+        return data
+
+    with pytest.raises(AssertionError, match="exited with code 3"):
+        run_cmdline_with_output(
+            lambda path: ["sh", "-c", f"printf abc > {path}; exit 3"], read_output
+        )
+
+
+def test_cmdline_with_output_stops_command_on_reader_error():
+    def read_output(output):
+        output.read(1)
+        raise ValueError("reader error")
+
+    with pytest.raises(ValueError, match="reader error"):
+        run_cmdline_with_output(lambda path: ["sh", "-c", f"yes > {path}"], read_output)
+
+
+def test_cmdline_with_input_reports_command_failure():
+    def write_input(stdin):
+        for _ in range(1024):
+            stdin.write(bytes(65536))
+
+    with pytest.raises(AssertionError, match="exited with code 3"):
+        run_cmdline_with_input(["sh", "-c", "exit 3"], write_input)